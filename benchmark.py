@@ -0,0 +1,139 @@
+"""
+Measures the throughput of the compiler on a synthetic datapack
+
+    python benchmark.py --functions 500 --output bench.json
+    python benchmark.py --functions 500 --baseline bench.json
+"""
+import mecha
+import os, sys, io, json, time, random, tempfile, argparse, contextlib
+import commands
+import compiler
+
+"""One of these is picked for every line, `{i}` is the line number and `{n}` a small random number"""
+LINES = [
+    # execute chains
+    "execute as @e[type=zombie,tag=group{n}] at @s run say zombie {i}",
+    "execute at @p positioned ~ ~{n} ~ rotated 90 0 run say moved {i}",
+    "execute in minecraft:the_nether anchored eyes align xyz run say nether {i}",
+    "execute if block ~ ~-1 ~ minecraft:stone run say stone {i}",
+    # selectors
+    "kill @e[type=creeper,tag=t{i},distance=..{n}]",
+    "kill @e[type=minecraft:skeleton,scores={{score{n}=1..{i}}},team=red]",
+    "tp @e[type=zombie,name=z{i}] ~ ~{n} ~",
+    "tp @a[level=1..{n}] @s",
+    # nbt literals
+    "kill @e[type=cow,nbt={{Tags:[\"n{i}\"],OnGround:1b}}]",
+    "give @a diamond_sword[max_stack_size={n}] {n}",
+    # macros
+    "$say $(value) {i}",
+    "$kill @e[tag=$(tag),limit={n}]",
+    # fallback commands
+    "particle minecraft:flame ~ ~{n} ~ 0 0 0 0 {i}",
+    "effect give @a minecraft:speed {n} 1",
+    "tellraw @a {{\"text\": \"line {i}\", \"color\": \"red\"}}",
+]
+
+def generate(functions: int, lines: int, seed: int) -> dict[str, str]:
+    """Returns the source of every generated function by its id"""
+    rand = random.Random(seed)
+    pack = {}
+    for function in range(functions):
+        source = []
+        for i in range(lines):
+            source.append(rand.choice(LINES).format(i=i, n=rand.randint(1, 16)))
+        pack[f"bench:function_{function}"] = "\n".join(source) + "\n"
+    return pack
+
+def write_pack(pack: dict[str, str], directory: str) -> None:
+    """Writes the generated functions as a datapack so it can be built with beet as well"""
+    for function_id, source in pack.items():
+        namespace, path = function_id.split(":")
+        path = os.path.join(directory, "data", namespace, "function", path + ".mcfunction")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(source)
+    with open(os.path.join(directory, "pack.mcmeta"), "w") as f:
+        json.dump({"pack": {"pack_format": 48, "description": "compiler benchmark"}}, f)
+
+def run(pack: dict[str, str]) -> dict[str, float]:
+    """Times every stage of a build once, in seconds"""
+    parser = mecha.Mecha()
+    build = commands.Pack(set(pack))
+    times = {}
+    start = time.perf_counter()
+    asts = [(function_id, parser.parse(source)) for function_id, source in pack.items()]
+    times["parse"] = time.perf_counter() - start
+    depots = commands.Depots()
+    functions = []
+    start = time.perf_counter()
+    # fallbacks print why they happened, that is part of the cost but not of the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        for function_id, ast in asts:
+            compiled = compiler.compile_ast(ast, parser, build)
+            depots.merge(compiled.depots)
+            functions.append((function_id, compiled.body))
+    times["compile"] = time.perf_counter() - start
+    start = time.perf_counter()
+    depots.package(io.StringIO())
+    times["package"] = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        compiler.write_entry_point(directory, "bench", functions, depots)
+        times["emit"] = time.perf_counter() - start
+    times["total"] = sum(times.values())
+    return times
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns a message for every stage that got slower than the baseline allows"""
+    regressions = []
+    for stage, seconds in results["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None or before == 0:
+            continue
+        ratio = seconds / before
+        if ratio > 1 + tolerance:
+            regressions.append(f"{stage}: {before:.4f}s -> {seconds:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+def main(argv: list[str] = None) -> int:
+    args = argparse.ArgumentParser(description="benchmarks the compiler on a synthetic datapack")
+    args.add_argument("--functions", type=int, default=200, help="amount of generated functions")
+    args.add_argument("--lines", type=int, default=20, help="commands per generated function")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--repeat", type=int, default=3, help="the fastest of this many runs is reported")
+    args.add_argument("--output", help="write the results as json to this file")
+    args.add_argument("--baseline", help="json written by a previous run to compare against")
+    args.add_argument("--tolerance", type=float, default=0.1, help="how much slower a stage may be than the baseline")
+    args.add_argument("--write-pack", metavar="DIRECTORY", help="also write the generated datapack to this directory")
+    args = args.parse_args(argv)
+
+    pack = generate(args.functions, args.lines, args.seed)
+    if args.write_pack:
+        write_pack(pack, args.write_pack)
+    runs = [run(pack) for _ in range(args.repeat)]
+    stages = {stage: min(times[stage] for times in runs) for stage in runs[0]}
+    results = {
+        "config": {"functions": args.functions, "lines": args.lines, "seed": args.seed, "repeat": args.repeat},
+        "stages": stages,
+        "commands_per_second": args.functions * args.lines / stages["total"],
+    }
+    for stage, seconds in stages.items():
+        print(f"{stage:>8}: {seconds:.4f}s")
+    print(f"{results['commands_per_second']:.0f} commands/s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != results["config"]:
+            print("WARNING: the baseline was measured with a different configuration")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,18 @@
 import mecha
 import builtins
-import inspect
 import re as regex
-from typing import Iterator, Callable, Any, Literal, overload
-from dataclasses import dataclass, field
+import hashlib
+from typing import Iterator, Callable, Any, Literal, TextIO, overload
+from dataclasses import dataclass, field, fields
+from emitter import write_template, estimate
 
-"""Can be used for anything that requires unique names"""
-counter: int = 0
+def digest(key: str) -> str:
+    """Can be used for anything that requires unique names, the same key always results in the same name"""
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+def function_method(function_id: str) -> str:
+    """Name of the method a compiled function ends up in"""
+    return f"function_{digest(function_id)}"
 
 @dataclass
 class Depot:
@@ -22,112 +28,308 @@ class Depot:
     def __contains__(self, obj) -> bool:
         return obj in self.contents
     
-    def package(self) -> str:
-        contents = ""
+    def package(self, out: TextIO) -> None:
+        sep = ""
+        last = None
         for key, content in self.contents.items():
             if isinstance(content, tuple):
                 content = content[0]
-            contents += f"// {key}\n" + content + self.sep
-        if len(self.sep) > 0 and len(contents) > 0: contents = contents[:-len(self.sep)]
-        return contents.rstrip()
+            if last is not None:
+                out.write(last)
+            out.write(sep)
+            out.write(f"// {key}\n")
+            last = content
+            sep = self.sep
+        if last is not None:
+            out.write(last.rstrip())
+
+"""Depots that initialize what another depot declares under the same key"""
+STATIC_DEPOTS = {
+    "static_nbt": "nbt",
+    "static_component": "component",
+    "static_selector": "selector",
+    "static_block_predicate": "block_predicate",
+    "static_item_stack": "item_stack",
+    "resolved_on_start": "resolved",
+}
+"""Depots in the order they depend on each other, entries only reference entries of earlier depots or earlier entries of the same depot"""
+DEPENDENCY_ORDER = [
+    "resource_location", "resolved", "nbt", "range_double", "range_int", "component", "scoreboard",
+    "selector", "item_stack", "block_predicate", "fallback", "macro", "commands",
+]
+DECLARATION = regex.compile(r"static (?:final )?[\w<>?, \[\].]+? (\w+)\s*[=;(]")
+IDENTIFIER = regex.compile(r"\w+")
+"""How many times the bytecode budget of a method a whole class may take"""
+CLASS_BUDGET = 8
 
 @dataclass
 class Depots:
-    commands = Depot()
-    resource_location = Depot()
-    nbt = Depot()
-    range_double = Depot()
-    range_int = Depot()
-    component = Depot()
-    selector = Depot()
-    block_predicate = Depot()
-    static_nbt = Depot()
-    static_component = Depot()
-    static_selector = Depot()
-    static_block_predicate = Depot()
+    commands: Depot = field(default_factory=Depot)
+    resource_location: Depot = field(default_factory=Depot)
+    resolved: Depot = field(default_factory=Depot)
+    resolved_on_start: Depot = field(default_factory=Depot)
+    nbt: Depot = field(default_factory=Depot)
+    range_double: Depot = field(default_factory=Depot)
+    range_int: Depot = field(default_factory=Depot)
+    component: Depot = field(default_factory=Depot)
+    selector: Depot = field(default_factory=Depot)
+    block_predicate: Depot = field(default_factory=Depot)
+    static_nbt: Depot = field(default_factory=Depot)
+    static_component: Depot = field(default_factory=Depot)
+    static_selector: Depot = field(default_factory=Depot)
+    static_block_predicate: Depot = field(default_factory=Depot)
+    fallback: Depot = field(default_factory=Depot)
+    macro: Depot = field(default_factory=Depot)
+    scoreboard: Depot = field(default_factory=Depot)
+    item_stack: Depot = field(default_factory=Depot)
+    static_item_stack: Depot = field(default_factory=Depot)
     
-    def package(self) -> str:
-        return f"""
+    """function id -> whether it was compiled when the call was generated"""
+    calls: dict[str, bool] = field(default_factory=dict)
+    """command key -> why it falls back to the dispatcher"""
+    fallbacks: dict[str, str] = field(default_factory=dict)
+    """function tag -> the members it was expanded to, `None` if it was left to be resolved at runtime"""
+    tags: dict[str, list[str] | None] = field(default_factory=dict)
+    """command key -> the compiled function it only calls, those calls may be replaced by the function body when linking"""
+    inline: dict[str, str] = field(default_factory=dict)
+    
+    def depots(self) -> Iterator[tuple[str, Depot]]:
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if isinstance(value, Depot):
+                yield f.name, value
+    
+    def merge(self, other: "Depots") -> None:
+        """Adds everything from `other` that isn't already present, names are derived from the keys so equal keys hold equal values"""
+        for name, depot in other.depots():
+            target = getattr(self, name)
+            for key, value in depot.contents.items():
+                if key not in target.contents:
+                    target.contents[key] = value
+        self.calls.update(other.calls)
+        self.fallbacks.update(other.fallbacks)
+        self.tags.update(other.tags)
+        self.inline.update(other.inline)
+    
+    def prune(self, code: Iterator[str]) -> None:
+        """Removes every entry that isn't referenced by `code` or by another entry that is kept"""
+        symbols = {}
+        for name, depot in self.depots():
+            if name in STATIC_DEPOTS:
+                continue
+            for key, value in depot.contents.items():
+                declaration = value[0] if isinstance(value, tuple) else value
+                match = DECLARATION.search(declaration)
+                if match is None:
+                    continue
+                statics = [getattr(self, static).contents.get(key, "") for static, declared in STATIC_DEPOTS.items() if declared == name]
+                symbols[match.group(1)] = (name, key, declaration + "".join(statics))
+        used = set()
+        pending = list(code)
+        while pending:
+            for identifier in IDENTIFIER.findall(pending.pop()):
+                if identifier in symbols and identifier not in used:
+                    used.add(identifier)
+                    pending.append(symbols[identifier][2])
+        for identifier, (name, key, _) in symbols.items():
+            if identifier in used:
+                continue
+            del getattr(self, name).contents[key]
+            for static, declared in STATIC_DEPOTS.items():
+                if declared == name:
+                    getattr(self, static).contents.pop(key, None)
+    
+    def shard(self, budget: int) -> list["Depots"]:
+        """
+        Splits the entries into parts that each become their own class, so no static initializer grows past `budget` bytes of bytecode.
+        The static initializer of a part only reads fields of its own and earlier parts, which keeps class initialization free of cycles.
+        Methods aren't ordered like that, every shard statically imports every other one and commands call functions in any part.
+        """
+        shards = [Depots()]
+        init = 0
+        size = 0
+        for name in DEPENDENCY_ORDER:
+            statics = [static for static, declared in STATIC_DEPOTS.items() if declared == name]
+            for key, value in getattr(self, name).contents.items():
+                declaration = value[0] if isinstance(value, tuple) else value
+                static_code = [getattr(self, static).contents[key] for static in statics if key in getattr(self, static).contents]
+                # commands are methods of their own, everything else ends up in the static initializer
+                entry_init = sum(map(estimate, static_code)) + (0 if name == "commands" else estimate(declaration))
+                entry_size = estimate(declaration) + sum(map(estimate, static_code))
+                if size > 0 and (init + entry_init > budget or size + entry_size > budget * CLASS_BUDGET):
+                    shards.append(Depots())
+                    init = 0
+                    size = 0
+                getattr(shards[-1], name)[key] = value
+                for static in statics:
+                    if key in getattr(self, static).contents:
+                        getattr(shards[-1], static)[key] = getattr(self, static).contents[key]
+                init += entry_init
+                size += entry_size
+        return shards
+    
+    def dump(self) -> dict:
+        """Converts the depots into something json serializable"""
+        out = {"calls": self.calls, "fallbacks": self.fallbacks, "tags": self.tags, "inline": self.inline}
+        for name, depot in self.depots():
+            contents = {}
+            for key, value in depot.contents.items():
+                if name == "commands":
+                    output, call, macros, walker = value
+                    value = (output, call, macros, {
+                        "returns": walker.returns,
+                        "reqiures_dispatcher": walker.reqiures_dispatcher,
+                        "reqiures_macros": walker.reqiures_macros,
+                    })
+                contents[key] = value
+            out[name] = contents
+        return out
+
+    @classmethod
+    def load(cls, data: dict) -> "Depots":
+        """Inverse of `dump`, restored commands hold a walker that only carries the flags `compile` hands out"""
+        depots = cls(calls=dict(data["calls"]), fallbacks=dict(data["fallbacks"]), tags=dict(data["tags"]), inline=dict(data["inline"]))
+        for name, depot in depots.depots():
+            for key, value in data[name].items():
+                if isinstance(value, list):
+                    value = tuple(value)
+                if name == "commands":
+                    output, call, macros, flags = value
+                    walker = Walker(iter(()), iter(()), None, depots, None, None, macros=macros, **flags)
+                    value = (output, call, macros, walker)
+                depot[key] = value
+        return depots
+
+    def package(self, out: TextIO) -> None:
+        write_template(out, """
         /* resource locations */
-        {self.resource_location.package()}
+        {resource_location}
+        
+        /* registry entries, keys and levels */
+        {resolved}
         
         /* nbt tags */
-        {self.nbt.package()}
+        {nbt}
         
         /* min max bounds */
-        {self.range_int.package()}
-        {self.range_double.package()}
+        {range_int}
+        {range_double}
         
         /* components */
-        {self.component.package()}
+        {component}
+        
+        /* objectives and teams */
+        {scoreboard}
         
         /* selectors */
-        {self.selector.package()}
+        {selector}
+        
+        /* item stacks, copied for every use */
+        {item_stack}
         
         /* block predicates */
-        {self.block_predicate.package()}
+        {block_predicate}
+        
+        /* commands left to the dispatcher, parsed once per reload */
+        {fallback}
+        
+        /* macro lines, parsed once per set of arguments */
+        {macro}
         
         static {{
             /* nbt */
-            {self.static_nbt.package()}
+            {static_nbt}
             
             /* components */
-            {self.static_component.package()}
+            {static_component}
+            
+            /* item stacks */
+            {static_item_stack}
             
             /* selectors */
-            {self.static_selector.package()}
+            {static_selector}
             
             /* block predicates */
-            {self.static_block_predicate.package()}
+            {static_block_predicate}
         }}
         
-        {self.commands.package()}
-        """
+        static void resolveOnStart(MinecraftServer server) {{
+            {resolved_on_start}
+        }}
+        
+        {commands}
+        """, **{name: depot.package for name, depot in self.depots()})
+
+@dataclass
+class Pack:
+    """What is known about the datapack at build time"""
+    """ids of the compiled functions"""
+    functions: set[str]
+    """function tag -> its members in execution order, only for tags this pack replaces where every member is a function of this pack"""
+    tags: dict[str, list[str]] = field(default_factory=dict)
+
+    def is_valid(self, depots: Depots) -> bool:
+        """Whether code compiled into `depots` (possibly in an earlier build) still matches this pack"""
+        for function_id, compiled in depots.calls.items():
+            if (function_id in self.functions) != compiled:
+                return False
+        for tag, members in depots.tags.items():
+            if self.tags.get(tag) != members:
+                return False
+        return True
 
-def compile(command: mecha.AstCommand, parser: mecha.Mecha, depots: Depots, functions: list[tuple]) -> tuple[str, list[str], "Walker"]:
-    global counter
+def compile(command: mecha.AstCommand, parser: mecha.Mecha, depots: Depots, pack: Pack, *, stored = False) -> tuple[str, list[str], "Walker"]:
+    """
+    Args:
+        stored: Whether the command is the rest of a chain after `execute store`, so it reports its result to the callback of the source.
+            Those can't fall back on their own as the dispatcher wouldn't report to the callback, the whole chain falls back instead.
+            The command at the very end isn't compiled this way, `execute store` reports what it returns itself, even when it falls back.
+    """
     key = parser.serialize(command)
+    if stored:
+        key = "store " + key
     if key in depots.commands:
         return depots.commands[key][1], depots.commands[key][2], depots.commands[key][3]
-    name = f"command_{counter}"
-    counter += 1
+    name = f"command_{digest(key)}"
     walker = Walker(
-        iter(command.identifier.split(':')),
+        iter(identifier_parts(command.identifier, parser)),
         iter(command.arguments),
         command,
         depots,
         parser,
-        functions,
+        pack,
+        stored=stored,
     )
     try:
-        walker.next(
-            say=lambda: say(walker),
-            mecha=lambda: macro(walker),
-            tp=lambda: tp(walker),
-            teleport=lambda: tp(walker),
-            kill=lambda: kill(walker),
-            give=lambda: give(walker),
-            function=lambda: function(walker),
-            execute=lambda: execute(walker),
-        )
+        walker.dispatch(COMMANDS)
     except Exception as e:
+        if stored:
+            raise e
         print(type(e).__name__, e, sep=": ")
         if not isinstance(e, (NotImplementedError, KeyError)):
             raise e
-        walker.output = f"""
+        depots.fallbacks[key] = f"{type(e).__name__}: {e}"
+        if key not in depots.fallback:
+            line = key
+            if command.identifier.startswith("execute:") and not key.startswith("execute"):
+                # the rest of an execute chain, the compiled part already applied everything before it to the source
+                line = "execute " + key
+            literal = line.replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$')
+            depots.fallback[key] = f'static final Fallback fallback_{digest(key)} = new Fallback("{literal}");\n'
+        walker.output = [f"""
             // {type(e)}: {e}
             /*\n{walker.command.dump(exclude=("location", "end_location"))}
             */
-            dispatcher.execute(dispatcher.parse("%s", source));
-            """ %parser.serialize(walker.command).replace('\\', '\\\\').replace('"', '\\"')
+            result = fallback_{digest(key)}.execute(source, dispatcher);
+            """]
         walker.reqiures_dispatcher = True
-    out = regex.sub(r"\n\s*?\n", "\n", walker.output)
+    out = regex.sub(r"\n\s*?\n", "\n", "".join(walker.output))
     name += "(CommandSourceStack source"
     if walker.reqiures_dispatcher: name += ", CommandDispatcher<CommandSourceStack> dispatcher"
     if walker.reqiures_macros: name += ", CompoundTag marcos"
     name += ")"
-    walker.output = f"""
-        private static {'MaybeReturn' if walker.returns == Maybe else 'int'} {name} throws CommandSyntaxException {{
+    method = f"""
+        static {'MaybeReturn' if walker.returns == Maybe else 'int'} {name} throws CommandSyntaxException {{
             int result = 0;
             {out}
             return {'new MaybeReturn(false, ' if walker.returns == Maybe else '('}result);
@@ -139,41 +341,76 @@ def compile(command: mecha.AstCommand, parser: mecha.Mecha, depots: Depots, func
     elif walker.returns == Maybe:
         name = f"if ({name}.out() instanceof Integer integer) return integer;"
     name += f"; // {key}\n"
-    depots.commands[key] = (walker.output, name, walker.macros, walker)
+    depots.commands[key] = (method, name, walker.macros, walker)
     return (name, walker.macros, walker)
 
 Maybe: Literal["Maybe"] = "Maybe"
+debug = "\n\t\t\t\t// %s\n"
+
+"""command identifier -> its parts and whether each stands for a node of the command, worked out once per identifier"""
+IDENTIFIER_PARTS: dict[str, tuple[tuple[str, bool], ...]] = {}
+
+def identifier_parts(identifier: str, parser: mecha.Mecha) -> tuple[tuple[str, bool], ...]:
+    parts = IDENTIFIER_PARTS.get(identifier)
+    if parts is not None:
+        return parts
+    parts = []
+    scope = parser.spec.tree
+    for part in identifier.split(":"):
+        child = (scope.children or {}).get(part) if scope is not None else None
+        # arguments are nodes, as are the parts mecha adds that aren't in the tree, like the `subcommand` of execute
+        parts.append((part, child is None or child.type == "argument"))
+        scope = child
+    parts = IDENTIFIER_PARTS[identifier] = tuple(parts)
+    return parts
 @dataclass
 class Walker:
-    identifiers: Iterator[str]
+    """the parts of the command's identifier and whether each consumes a node, from `identifier_parts`"""
+    identifiers: Iterator[tuple[str, bool]]
     nodes: Iterator[mecha.AstNode]
     command: mecha.AstCommand
     depots: Depots
     parser: mecha.Mecha
-    functions: list[tuple]
+    pack: Pack
     
     macros: list[str] = field(default_factory=list)
-    output: str = ""
+    """chunks of generated code, joined once the command is done"""
+    output: list[str] = field(default_factory=list)
     reqiures_dispatcher: bool = False
     reqiures_macros: bool = False
+    """whether the command is part of a chain after `execute store`"""
+    stored: bool = False
     returns: bool | Literal["Maybe"] = False
     
     chain_args: dict[str, Callable] = field(default_factory=dict)
     
     def next(self, **functions: dict[str, Callable]) -> Any:
-        functions.update(self.chain_args)
-        identifier = builtins.next(self.identifiers, None)
+        identifier, consumes = builtins.next(self.identifiers, (None, False))
         if identifier is None:
             return
-        f = functions[identifier]
-        debug = "\n\t\t\t\t// %s\n"
-        if len(inspect.getfullargspec(f).args) > 0:
+        f = functions.get(identifier)
+        if f is None:
+            f = self.chain_args[identifier]
+        # the handler of an argument is passed its node, the handler of a literal nothing
+        if consumes:
             node = builtins.next(self.nodes)
-            self.output += debug %self.parser.serialize(node)
+            self.emit(debug %self.parser.serialize(node))
             return f(node)
         else:
-            self.output += debug %identifier
+            self.emit(debug %identifier)
             return f()
+    
+    def dispatch(self, handlers: dict[str, Callable[["Walker"], Any]]) -> Any:
+        """Like `next` but for handlers registered once up front, which are passed the walker instead"""
+        identifier, _ = builtins.next(self.identifiers, (None, False))
+        if identifier is None:
+            return
+        f = handlers[identifier]
+        self.emit(debug %identifier)
+        return f(self)
+    
+    def emit(self, code: str) -> None:
+        self.output.append(code)
 
 def range_doubles(node: mecha.AstRange, walker: Walker) -> str:
     key = walker.parser.serialize(node)
@@ -190,7 +427,7 @@ def range_doubles(node: mecha.AstRange, walker: Walker) -> str:
     if node.max is not None:
         max = f"Optional.of((double) {node.max})"
         maxSq = f"Optional.of((double) {node.max ** 2})"
-    walker.depots.range_double[key] = f"private static final MinMaxBounds.Doubles {name} = new MinMaxBounds.Doubles({min}, {max}, {minSq}, {maxSq});\n"
+    walker.depots.range_double[key] = f"static final MinMaxBounds.Doubles {name} = new MinMaxBounds.Doubles({min}, {max}, {minSq}, {maxSq});\n"
     return name
 
 def range_ints(node: mecha.AstRange, walker: Walker) -> str:
@@ -208,7 +445,7 @@ def range_ints(node: mecha.AstRange, walker: Walker) -> str:
     if node.max is not None:
         max = f"Optional.of((int) {node.max})"
         maxSq = f"Optional.of((long) {node.max ** 2})"
-    walker.depots.range_int[key] = f"private static final MinMaxBounds.Ints {name} = new MinMaxBounds.Ints({min}, {max}, {minSq}, {maxSq});\n"
+    walker.depots.range_int[key] = f"static final MinMaxBounds.Ints {name} = new MinMaxBounds.Ints({min}, {max}, {minSq}, {maxSq});\n"
     return name
 
 def resource_location(node: mecha.AstResourceLocation, walker: Walker) -> str:
@@ -221,21 +458,46 @@ def resource_location(node: mecha.AstResourceLocation, walker: Walker) -> str:
     else:
         value = f'ResourceLocation.fromNamespaceAndPath("{node.namespace}", "{node.path}")'
         name += f"{node.namespace}_{node.path}".replace("/", "SLASH").replace(".", "DOT")
-    walker.depots.resource_location[key] = f"private static final ResourceLocation {name} = {value};\n"
+    walker.depots.resource_location[key] = f"static final ResourceLocation {name} = {value};\n"
+    return name
+
+def resolved(type: str, prefix: str, value: str, walker: Walker, *, on_start = False) -> str:
+    """
+    A static field holding `value`, computed once when the class is loaded.
+    
+    Args:
+        on_start: Whether `value` can only be computed once the server started (it can use `server`), like levels.
+    """
+    key = f"{type} {value}"
+    if key in walker.depots.resolved:
+        return walker.depots.resolved[key][1]
+    name = f"{prefix}_{digest(key)}"
+    if on_start:
+        walker.depots.resolved[key] = (f"static {type} {name};\n", name)
+        walker.depots.resolved_on_start[key] = f"{name} = {value};\n"
+    else:
+        walker.depots.resolved[key] = (f"static final {type} {name} = {value};\n", name)
     return name
 
+def registry_tag(registry: str, type: str, location: str, walker: Walker) -> str:
+    return resolved(f"TagKey<{type}>", "TagKey", f"TagKey.create(Registries.{registry}, {location})", walker)
+
+def level(location: str, walker: Walker) -> str:
+    """The level of a dimension, `null` if the server doesn't have it"""
+    return resolved("ServerLevel", "Level", f"server.getLevel(ResourceKey.create(Registries.DIMENSION, {location}))", walker, on_start=True)
+
 def nbt(node: mecha.AstNbtValue, walker: Walker, *, return_type = False) -> str:
     """
     Args:
         return_type: Whether or not to return the type of the nbt value.
     """
-    global counter
     key = walker.parser.serialize(node)
     if key in walker.depots.nbt.contents:
         return walker.depots.nbt[key][1]
-    counter += 1
+    suffix = digest(key)
+    counter = 0
     def eval(node: mecha.AstNbtValue, tmp = True) -> tuple[str, str]:
-        global counter
+        nonlocal counter
         tmp = 'var ' if tmp else ''
         name = None
         static = ""
@@ -245,7 +507,7 @@ def nbt(node: mecha.AstNbtValue, walker: Walker, *, return_type = False) -> str:
             type = "ByteTag"
         elif isinstance(node, mecha.AstNbtCompound):
             type = "CompoundTag"
-            name = "CompoundTag_%i" %counter
+            name = f"CompoundTag_{suffix}_{counter}"
             counter += 1
             static += f"{tmp}{name} = new CompoundTag();\n"
             for entry in node.entries:
@@ -254,7 +516,7 @@ def nbt(node: mecha.AstNbtValue, walker: Walker, *, return_type = False) -> str:
                 static += f'{name}.put("{entry.key.value}", {symbol});\n'
         elif isinstance(node, mecha.AstNbtList):
             type = "ListTag"
-            name = "ListTag_%i" %counter
+            name = f"ListTag_{suffix}_{counter}"
             counter += 1
             static += f"{tmp}{name} = new ListTag();\n"
             for element in node.elements:
@@ -287,12 +549,12 @@ def nbt(node: mecha.AstNbtValue, walker: Walker, *, return_type = False) -> str:
                     type = "StringTag"
                 case otherwise: 
                     raise NotImplemented(f"couldn't find nbt type {otherwise}")
-            name = f"{type}_{counter}"
+            name = f"{type}_{suffix}_{counter}"
             counter += 1
             static += f"{tmp}{name} = {value};\n"
         return (name, static, type)
     symbol, init, type = eval(node, tmp=False)
-    walker.depots.nbt[key] = (f"private static final {type} {symbol};\n", symbol)
+    walker.depots.nbt[key] = (f"static final {type} {symbol};\n", symbol)
     walker.depots.static_nbt[key] = init
     if return_type:
         return (symbol, type)
@@ -345,8 +607,48 @@ def vec2(rotation: str, node: mecha.AstVector2):
     y = do(node.y, "y")
     return f"new Vec2({x[1]} + {x[0]}, {y[1]} + {y[0]})"
             
+"""Static cost of selector predicates, cheaper ones run first"""
+CHEAP = 0
+SCORES = 1
+ADVANCEMENTS = 2
+NBT = 3
+
+def scoreboard_lookup(type: Literal["Objective", "PlayerTeam"], name: str, walker: Walker) -> str:
+    """An objective or team resolved by name at most once per tick"""
+    key = f"{type} {name}"
+    if key in walker.depots.scoreboard:
+        return walker.depots.scoreboard[key][1]
+    field = f"{type}_{digest(key)}"
+    lookup = "getObjective" if type == "Objective" else "getPlayerTeam"
+    walker.depots.scoreboard[key] = (f'static final Named<{type}> {field} = new Named<>("{name}", Scoreboard::{lookup});\n', field)
+    return field
+
+def score_holder(node: mecha.AstNode, walker: Walker) -> str:
+    """A single score holder, `@s` is the entity of the source without evaluating a selector"""
+    if isinstance(node, mecha.AstPlayerName):
+        # single quotes, so `$` in fake player names isn't interpolated by groovy
+        name = node.value.replace("\\", "\\\\").replace("'", "\\'")
+        return resolved("ScoreHolder", "ScoreHolder", f"ScoreHolder.forNameOnly('{name}')", walker)
+    if isinstance(node, mecha.AstSelector):
+        if node.variable == "s" and len(node.arguments) == 0:
+            return "source.getEntityOrException()"
+        return selector(node, walker, single=True)
+    raise NotImplementedError(f"{type(node).__name__} as a single score holder")
+
+def score_holders(node: mecha.AstNode, name: str, walker: Walker) -> tuple[str, str, str]:
+    """
+    Code finding the score holders `node` stands for, which fails when there are none like the argument does,
+    code declaring `name` for each of them, in a loop unless there's only one, and the code closing it
+    """
+    if isinstance(node, mecha.AstWildcard):
+        holders = "new ArrayList<>(source.getServer().getScoreboard().getTrackedPlayers())"
+    elif isinstance(node, mecha.AstSelector) and not (node.variable == "s" and len(node.arguments) == 0):
+        holders = selector(node, walker, single=False)
+    else:
+        return f"ScoreHolder {name} = {score_holder(node, walker)};\n", "", ""
+    return f"var {name}s = scoreHolders({holders});\n", f"for (ScoreHolder {name} : {name}s) {{\n", "}\n"
+
 def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False) -> str:
-    global counter
     key = walker.parser.serialize(node)
     if key in walker.depots.selector:
         getMethod = ""
@@ -361,12 +663,12 @@ def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False)
             else:
                 getMethod = "findPlayers"
         return f"{walker.depots.selector[key][1]}.{getMethod}(source)"
-    name = "Selector_%i" %counter
-    counter += 1
+    name = f"Selector_{digest(key)}"
     maxResults = "EntitySelector.INFINITE"
     includesEntities = "false" if player else "true"
     worldLimited = "false"
-    predicates = ""
+    # (cost, predicate), sorted by cost before they are emitted so cheap checks reject entities first
+    predicates = []
     range = "MinMaxBounds.Doubles.ANY"
     x = "old.x"
     y = "old.y"
@@ -374,26 +676,25 @@ def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False)
     dx = None
     dy = None
     dz = None
-    order = "null"
+    distance = None
+    order = "arbitrary"
     currentEntity = "false"
     playerName = "null"
     entityUUID = "null"
     type = "null"
     usesSelector = "false"
-    def add_predicate(predicate: str, inverted = False) -> None:
-        nonlocal predicates
+    def add_predicate(predicate: str, inverted = False, cost = CHEAP) -> None:
         invert = "!" if inverted else ""
-        predicates += f'entity -> {invert}{predicate}, '
-    def add_player_predicate(predicate: str, inverted = False, before = "") -> None:
-        nonlocal predicates
+        predicates.append((cost, f'entity -> {invert}{predicate}'))
+    def add_player_predicate(predicate: str, inverted = False, before = "", cost = CHEAP) -> None:
         invert = "!" if inverted else ""
-        predicates +=  f"""entity -> {{
+        predicates.append((cost, f"""entity -> {{
             if (entity instanceof ServerPlayer) {{
                 {before}
                 return {invert}{predicate};
             }}
             return false;
-        }}, """
+        }}"""))
     if isinstance(node, mecha.AstSelector):
         usesSelector = "true"
         match node.variable:
@@ -405,16 +706,17 @@ def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False)
                 includesEntities = "false"
                 maxResults = "1"
                 worldLimited = "true"
-                order = "Sort.NEAREST"
+                order = "nearest"
             case "r":
                 includesEntities = "false"
-                order = "Sort.RANDOM"
+                maxResults = "1"
+                order = "random"
             case "s":
                 currentEntity = "true"
             case "n":
                 maxResults = "1"
                 worldLimited = "true" 
-                order = "Sort.NEAREST"
+                order = "nearest"
         for arg in node.arguments:
             match arg.key.value:
                 case "x":
@@ -439,6 +741,7 @@ def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False)
                     add_predicate(f'entity.getTags().contains("{arg.value.value}")', arg.inverted)
                 case "distance":
                     range = range_doubles(arg.value, walker)
+                    distance = arg.value.max
                     worldLimited = "true"
                 case "x_rotation":
                     add_predicate(f'{range_doubles(arg.value, walker)}.matches(entity.getXRot())')
@@ -447,19 +750,21 @@ def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False)
                 case "type":
                     if (not arg.inverted) and arg.value.path == "player" and (arg.value.namespace == None or arg.value.namespace == "minecraft"):
                         includesEntities = "false"
+                    elif not arg.inverted and not arg.value.is_tag:
+                        # the level only looks at entities of this type
+                        type = resolved("EntityType<?>", "EntityType", f"BuiltInRegistries.ENTITY_TYPE.get({resource_location(arg.value, walker)})", walker)
                     else:
-                        end = ""
                         if not arg.value.is_tag:
-                            end = (f"HolderSet.direct(Holder.direct(BuiltInRegistries.ENTITY_TYPE.get({resource_location(arg.value, walker)})))")
+                            type_ = resolved("EntityType<?>", "EntityType", f"BuiltInRegistries.ENTITY_TYPE.get({resource_location(arg.value, walker)})", walker)
+                            add_predicate(f"(entity.getType() == {type_})", arg.inverted)
                         else:
-                            end = (f"TagKey.create(Registries.ENTITY_TYPE, {resource_location(arg.value, walker)})")
-                        add_predicate(f"entity.getType().is({end})", arg.inverted)
+                            add_predicate(f"entity.getType().is({registry_tag('ENTITY_TYPE', 'EntityType<?>', resource_location(arg.value, walker), walker)})", arg.inverted)
                 case "gamemode":
                     add_player_predicate(f'entity.gameMode.getGameModeForPlayer() == GameType.byName("{arg.value.value}")', arg.inverted)
                 case "advancements":
                     for match in arg.value.advancements:
                         if isinstance(match.value, mecha.AstBool):
-                            add_player_predicate(f'entity.getAdvancements().getOrStartProgress(Objects.requireNonNull(entity.getServer().getAdvancements().tree().get({resource_location(match.key, walker)})).holder()).isDone()', match.value.value)
+                            add_player_predicate(f'entity.getAdvancements().getOrStartProgress(Objects.requireNonNull(entity.getServer().getAdvancements().tree().get({resource_location(match.key, walker)})).holder()).isDone()', match.value.value, cost=ADVANCEMENTS)
                         else: 
                             completed = ""
                             unfinished = ""
@@ -481,7 +786,7 @@ def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False)
                                     if (!valid[0]) return;
                                     valid[0] = completed.contains(it) || !unfinished.contains(it);
                                 }});
-                                """, predicate="valid"
+                                """, predicate="valid", cost=ADVANCEMENTS
                             )
                 case "predicate":
                     raise NotImplementedError("predicates are not yet implemented (and probably never will be)") # tried for 3 hours
@@ -489,32 +794,42 @@ def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False)
                     add_predicate(f'entity.getName().getString().equals("{arg.value.value}")', arg.inverted)
                 case "level":
                     add_player_predicate(f'{range_doubles(arg.value, walker)}.matches(entity.experienceLevel)')
+                case "limit":
+                    maxResults = str(arg.value.value)
                 case "sort":
                     match arg.value.value:
                         case "nearest": 
-                            order = "Sort.NEAREST"
+                            order = "nearest"
                             worldLimited = "true"
                         case "furthest": 
-                            order = "Sort.FURTHEST"
+                            order = "furthest"
                             worldLimited = "true"
                         case "arbitrary": 
-                            order = "Sort.ARBITRARY"
+                            order = "arbitrary"
                         case "random": 
-                            order = "Sort.RANDOM"
+                            order = "random"
                         case _: 
                             raise
                 case "nbt":
-                    add_predicate(f"nbtMatches(new EntityDataAccessor(entity).getData(), {nbt(arg.value, walker)})")
+                    data = entity_data("entity", {entry.key.value for entry in arg.value.entries})
+                    add_predicate(f"nbtMatches({data}, {nbt(arg.value, walker)})", arg.inverted, cost=NBT)
                 case "scores":
                     for score in arg.value.scores:
-                        add_predicate(f'{range_ints(score.value, walker)}.matches(entity.getServer().getScoreboard().getPlayerScoreInfo(entity, entity.getServer().getScoreboard().getObjective("{score.key.value}")).value())')
+                        objective = scoreboard_lookup("Objective", score.key.value, walker)
+                        add_predicate(f"""{{
+                            var objective = {objective}.get(entity.getServer());
+                            if (objective == null) return false;
+                            var score = entity.getServer().getScoreboard().getPlayerScoreInfo(entity, objective);
+                            return score != null && {range_ints(score.value, walker)}.matches(score.value());
+                        }}""", cost=SCORES)
                 case "team":
-                    if arg.value.value is None:
-                        add_predicate(f"entity.getTeam() == null")
+                    if arg.value is None or arg.value.value is None:
+                        add_predicate(f"(entity.getTeam() == null)", arg.inverted)
                     else:
-                        add_predicate(f'entity.getTeam() != null && entity.getTeam().getName().equals("{arg.value.value}")')
+                        team = scoreboard_lookup("PlayerTeam", arg.value.value, walker)
+                        add_predicate(f"(entity.getTeam() != null && entity.getTeam() == {team}.get(entity.getServer()))", arg.inverted)
                 case thing:
-                    raise NotImplemented("selector argument '" + thing + "' is not implemented")
+                    raise NotImplementedError("selector argument '" + thing + "' is not implemented")
     elif isinstance(node, mecha.AstPlayerName):
         playerName = '"' + node.value + '"'
     elif isinstance(node, mecha.AstUUID):
@@ -533,17 +848,23 @@ def selector(node: mecha.AstNode, walker: Walker, single: bool, player = False)
             getMethod = "findEntities"
         else:
             getMethod = "findPlayers"
+    if order == "arbitrary":
+        # lets the selector stop looking once it found enough entities
+        order = "EntitySelector.ORDER_ARBITRARY"
+    else:
+        order = f"Sort.{order}({maxResults})"
+    # the level only looks at entity sections that intersect this box, same bounds as vanilla's selector parser
     aabb = "null"
     if dx is not None or dy is not None or dz is not None:
         if dx is None: dx = 0
         if dy is None: dy = 0
         if dz is None: dz = 0
-        aabb = f"new AABB(Vec3.ZERO, new Vec3({dx+1}, {dy+1}, {dz+1}))"
-    if (len(predicates) > 0):
-        predicates = predicates[:-2]
-    walker.depots.selector[key] = (f"private static final EntitySelector {name};\n", name)
+        aabb = f"new AABB({min(0, dx)}, {min(0, dy)}, {min(0, dz)}, {max(0, dx) + 1}, {max(0, dy) + 1}, {max(0, dz) + 1})"
+    elif distance is not None:
+        aabb = f"new AABB({-distance}, {-distance}, {-distance}, {distance + 1}, {distance + 1}, {distance + 1})"
+    walker.depots.selector[key] = (f"static final EntitySelector {name};\n", name)
     walker.depots.static_selector[key] = f"""{name} = new EntitySelector(
-                {maxResults}, {includesEntities}, {worldLimited}, List.of({predicates}),
+                {maxResults}, {includesEntities}, {worldLimited}, List.of({", ".join(predicate for _, predicate in sorted(predicates, key=lambda it: it[0]))}),
                 {range}, old -> new Vec3({x}, {y}, {z}), {aabb}, {order}, {currentEntity},
                 {playerName}, {entityUUID}, {type}, {usesSelector}
             );\n"""
@@ -553,7 +874,6 @@ def entity_anchor(node: mecha.AstEntityAnchor) -> str:
     return f"EntityAnchorArgument.Anchor.{node.value.upper()}"
 
 def components(nodes: mecha.AstChildren[mecha.AstItemComponent], walker: Walker) -> str:
-    global counter
     if len(nodes) == 0:
         return "DataComponentPatch.EMPTY"
     key = ""
@@ -561,49 +881,108 @@ def components(nodes: mecha.AstChildren[mecha.AstItemComponent], walker: Walker)
         key += walker.parser.serialize(node) + "\t"
     if key in walker.depots.component.contents:
         return walker.depots.component[key][1]
-    name = "Components_%i" %counter
+    name = f"Components_{digest(key)}"
     builder = name + "_Builder"
-    counter += 1
     static = f"var {builder} = DataComponentPatch.builder();\n"
     for node in nodes:
         data, type = nbt(node.value, walker, return_type=True)
-        static += f"{builder}.set((DataComponentType<{type}>) BuiltInRegistries.DATA_COMPONENT_TYPE.get({resource_location(node.key, walker)}), {data});\n"
+        component_type = resolved("DataComponentType<?>", "DataComponentType", f"BuiltInRegistries.DATA_COMPONENT_TYPE.get({resource_location(node.key, walker)})", walker)
+        static += f"{builder}.set((DataComponentType<{type}>) {component_type}, {data});\n"
     static += f"{name} = {builder}.build();\n"
-    walker.depots.component[key] = (f"private static final DataComponentPatch {name};", name)
+    walker.depots.component[key] = (f"static final DataComponentPatch {name};", name)
     walker.depots.static_component[key] = static
     return name
     
-def item_stack(node: mecha.AstItemStack, walker: Walker, *, count: int) -> str:
-    return f"new ItemStack(Holder.direct(BuiltInRegistries.ITEM.get({resource_location(node.identifier, walker)})), {count}, {components(node.arguments, walker)})"
+def item_stack(node: mecha.AstItemStack, walker: Walker, *, count: int | str) -> str:
+    """A new stack of the item, copied from a prototype that is built once with the item's components"""
+    key = walker.parser.serialize(node)
+    if key not in walker.depots.item_stack:
+        name = f"ItemStack_{digest(key)}"
+        walker.depots.item_stack[key] = (f"static final ItemStack {name};\n", name)
+        item = resolved("Holder<Item>", "Item", f"BuiltInRegistries.ITEM.wrapAsHolder(BuiltInRegistries.ITEM.get({resource_location(node.identifier, walker)}))", walker)
+        walker.depots.static_item_stack[key] = f"{name} = new ItemStack({item}, 1, {components(node.arguments, walker)});\n"
+    return f"{walker.depots.item_stack[key][1]}.copyWithCount({count})"
+
+"""Top level keys of entity data that `entityData` reads without serializing the whole entity"""
+ENTITY_DATA = {
+    "OnGround": "DATA_ON_GROUND",
+    "Health": "DATA_HEALTH",
+    "Tags": "DATA_TAGS",
+    "SelectedItem": "DATA_SELECTED_ITEM",
+    "Inventory": "DATA_INVENTORY",
+}
+
+def entity_data(entity: str, keys: set[str] | None) -> str:
+    """Data of `entity` that is guaranteed to hold `keys`, `None` if every key could be needed"""
+    if keys is None or not keys <= ENTITY_DATA.keys():
+        return f"new EntityDataAccessor({entity}).getData()"
+    return f"entityData({entity}, {' | '.join(ENTITY_DATA[key] for key in sorted(keys)) or '0'})"
 
-def access_data(walker: Walker) -> str:
+def access_data(walker: Walker, path: Callable[[str, mecha.AstNbtPath], str] = None) -> str:
+    """
+    Args:
+        path: Is given the data and the nbt path that follows it if there is one, so only the keys on that path are read from entities.
+    """
     output = None
+    data: Callable[[set[str] | None], str] = None
     def block():
         nonlocal output
         block_pos = None
         def sourcePos(node: mecha.AstVector3):
             nonlocal block_pos
             block_pos = vec3("source.getAnchor().apply(source)", "source.getRotation()", node, vec3i=True)
-        walker.next(sourcePos=sourcePos)
-        output = f"new BlockDataAccessor(source.getLevel().getBlockEntity(new BlockPos({block_pos})), new BlockPos({block_pos})).getData()"
+        walker.next(sourcePos=sourcePos, targetPos=sourcePos)
+        output = f"blockData(source, new BlockPos({block_pos})).getData()"
     def entity():
         nonlocal output
         source_entity = None
         def source(node: mecha.AstNode):
             nonlocal source_entity
             source_entity = selector(node, walker, True)
-        walker.next(source=source)
-        output = f"new EntityDataAccessor({source_entity}).getData()"
+        walker.next(source=source, target=source)
+        nonlocal data
+        data = lambda keys: entity_data(source_entity, keys)
     def storage():
         nonlocal output
         source_storage = None
         def source(node: mecha.AstResourceLocation):
             nonlocal source_storage
             source_storage = resource_location(node, walker)
-        walker.next(source=source)
+        walker.next(source=source, target=source)
         output = f"source.getServer().getCommandStorage().get({source_storage})"
     walker.next(block=block, entity=entity, storage=storage)
-    return output
+    result = None
+    def path_(node: mecha.AstNbtPath):
+        nonlocal result
+        keys = None
+        if len(node.components) > 0 and isinstance(node.components[0], mecha.AstNbtPathKey):
+            keys = {node.components[0].value}
+        result = path(output if data is None else data(keys), node)
+    if path is not None:
+        walker.next(path=path_)
+    if result is None:
+        return output if data is None else data(None)
+    return result
+
+def data_accessor(walker: Walker, kind: Literal["block", "entity", "storage"] | None = None) -> str:
+    """The `DataAccessor` of the block, entity or storage a data command writes to or reads from, `kind` is which one if that was already read"""
+    def block():
+        pos = walker.next(targetPos=lambda node: vec3(node, vec3i=True), sourcePos=lambda node: vec3(node, vec3i=True))
+        return f"blockData(source, new BlockPos({pos}))"
+    def entity():
+        target = lambda node: f"new EntityDataAccessor({selector(node, walker, True)})"
+        return walker.next(target=target, source=target)
+    def storage():
+        target = lambda node: f"new StorageDataAccessor(source.getServer().getCommandStorage(), {resource_location(node, walker)})"
+        return walker.next(target=target, source=target)
+    if kind is not None:
+        return {"block": block, "entity": entity, "storage": storage}[kind]()
+    return walker.next(block=block, entity=entity, storage=storage)
+
+def nbt_path_argument(node: mecha.AstNbtPath, walker: Walker) -> str:
+    """The path parsed once into what the data command itself works with"""
+    literal = walker.parser.serialize(node).replace("\\", "\\\\").replace("'", "\\'")
+    return resolved("NbtPathArgument.NbtPath", "NbtPath", f"new NbtPathArgument().parse(new StringReader('{literal}'))", walker)
 
 def nbt_path(root: str, node: mecha.AstNbtPath, walker: Walker, *, single: bool):
     for component in node.components:
@@ -633,7 +1012,7 @@ def nbt_path(root: str, node: mecha.AstNbtPath, walker: Walker, *, single: bool)
 def facing(walker: Walker):
     def facingLocation(node: mecha.AstVector3):
         value = vec3("source.getAnchor().apply(source)", "source.getRotation()", node)
-        walker.output += f"source = source.facing({value});\n"
+        walker.emit(f"source = source.facing({value});\n")
     def entity():
         def facingEntity(node: mecha.AstNode):
             value = selector(node, walker, True)
@@ -642,7 +1021,7 @@ def facing(walker: Walker):
                 nonlocal anchor
                 anchor = entity_anchor(node)
             walker.next(facingAnchor=facingAnchor)
-            walker.output += f"source = source.facing({value}, {anchor});\n"
+            walker.emit(f"source = source.facing({value}, {anchor});\n")
         walker.next(facingEntity=facingEntity)
     walker.next(facingLocation=facingLocation, entity=entity)
     
@@ -650,90 +1029,124 @@ def heightmap(node: mecha.AstHeightmap) -> str:
     return f"Heightmap.Types.{node.value.upper()}"
 
 def block_predicate(node: mecha.AstBlock, walker: Walker) -> str:
-    global counter
     key = walker.parser.serialize(node)
     if key in walker.depots.block_predicate:
         return walker.depots.block_predicate[key][1]
-    name = f"BlockPredicate_{counter}"
-    counter += 1
-    walker.depots.block_predicate[key] = (f"private static BlockPredicate {name};\n", name)
+    name = f"BlockPredicate_{digest(key)}"
+    walker.depots.block_predicate[key] = (f"static BlockPredicate {name};\n", name)
     out = "{"
     resource = resource_location(node.identifier, walker)
     if node.identifier.is_tag:
         out += f"""
-            var blocks = TagKey.create(Registries.BLOCK, {resource});
+            var blocks = {registry_tag('BLOCK', 'Block', resource, walker)};
             var stateDefintion = BuiltInRegistries.BLOCK.getTagOrEmpty(blocks).iterator().next().unwrap().right().orElseThrow().getStateDefinition();
         """
     else:
         out += f"""
-            var blocks = BuiltInRegistries.BLOCK.get({resource});
+            var blocks = {resolved("Block", "Block", f"BuiltInRegistries.BLOCK.get({resource})", walker)};
             var stateDefintion = blocks.getStateDefinition();
         """
     out += f"{name} = BlockPredicate.Builder.block().of(blocks)"
     if len(node.block_states) > 0:
         out += ".setProperties(StatePropertiesPredicate.Builder.properties()"
         for state in node.block_states:
-            out += f'\n.hasProperty(stateDefintion.getProperty("{state.key}"), "{state.value}"))'
+            out += f'\n.hasProperty(stateDefintion.getProperty("{state.key.value}"), "{state.value.value}")'
         out += ")"
     if node.data_tags is not None:
         out += f".hasNbt({nbt(node.data_tags, walker)})"
     out += ".build();\n}\n"
+    walker.depots.static_block_predicate[key] = out
     return name
 
-def run_function(node: mecha.AstResourceLocation, walker: Walker, *, on_error = "throw new RuntimeException(e);", macros = "new CompoundTag();", post_exec = "") -> str:
-    call: str = None
+def function_id(node: mecha.AstResourceLocation) -> str:
+    """The id of a function (or function tag) without the leading `#`, always with its namespace"""
+    return f"{node.namespace or 'minecraft'}:{node.path}"
+
+def run_function(node: mecha.AstResourceLocation, walker: Walker, *, on_error = "throw new RuntimeException(e);", macros = "NO_MACROS", post_exec = "", callback = "CommandResultCallback.EMPTY") -> str:
+    """Calls a function or every function of a tag, `callback` hears of the ones that return"""
     location = resource_location(node, walker)
-    if node.is_tag:
-        call = f"""
-            source.getServer().getFunctions().getTag({location}).forEach(func -> {{
-                int executionResult;
-                try {{
-                    if (COMPILED.contains(func.id().toString())) {{
-                        executionResult = function(source, func.id().toString(), {macros}, dispatcher);
-                    }} else {{
-                        executionResult = func.instantiate({macros}, dispatcher);
-                    }}
-                }} catch (Exception e) {{
-                    {on_error}
-                }}
-                {post_exec}
-            }});
-            """
-    else:
-        call = "int executionResult;\ntry {{\n"
-        raw = walker.parser.serialize(node)
-        for func in walker.functions:
-            if func[0] == raw:
-                call += f'executionResult = function(source, "{raw}", {macros}, dispatcher);\n'
-                break
-        else:
-            call += f'executionResult = source.getServer().getFunctions().get({location}).orElseThrow().instantiate({macros}, dispatcher);'
-        call += f"""
+    def call(statement: str) -> str:
+        if on_error == "throw new RuntimeException(e);":
+            # exceptions would only be rethrown
+            return f"{statement}\n{post_exec}"
+        return f"""
+            try {{
+                {statement}
             }} catch (Exception e) {{
                 {on_error}
             }}
             {post_exec}
         """
-    return call
+    def member(id: str, location: str) -> str:
+        walker.depots.calls[id] = id in walker.pack.functions
+        if id in walker.pack.functions:
+            # shards import each other, so the method of every compiled function is in scope
+            # compiled functions never return, so the callback does not hear of them
+            return call(f'{function_method(id)}(source, {macros}, dispatcher);')
+        return call(f'runFunction(source, source.getServer().getFunctions().get({location}).orElseThrow(), {macros}, dispatcher, {callback});')
+    if not node.is_tag:
+        return member(function_id(node), location)
+    id = function_id(node)
+    members = walker.pack.tags.get(id)
+    walker.depots.tags[id] = members
+    if members is not None:
+        # every member is known, so the tag is unrolled into direct calls
+        out = "{\n"
+        for member_id in members:
+            namespace, path = member_id.split(":", 1)
+            out += member(member_id, resource_location(mecha.AstResourceLocation(namespace=namespace, path=path), walker))
+        return out + "}\n"
+    body = call(f"""
+        if (member.compiled() != null) {{
+            member.compiled().run(source, {macros}, dispatcher);
+        }} else {{
+            runFunction(source, member.function(), {macros}, dispatcher, {callback});
+        }}
+    """)
+    return f"""
+        for (var member : functionTag(source.getServer(), {location})) {{
+            {body}
+        }}
+        """
+
+"""command identifier -> handler, filled by `command`"""
+COMMANDS: dict[str, Callable[[Walker], None]] = {}
+
+def command(*identifiers: str) -> Callable:
+    def register(handler: Callable[[Walker], None]) -> Callable[[Walker], None]:
+        for identifier in identifiers:
+            COMMANDS[identifier] = handler
+        return handler
+    return register
 
 ##################
 
+@command("mecha")
 def macro(walker: Walker):
-    command = ""
+    # the text around the variables, there is always one more of these than variables
+    text = [""]
+    values = []
     macros = []
     for child in walker.command.arguments:
         if isinstance(child, mecha.AstMacroLineText):
-            command += f'"{child.value}" + '
+            text[-1] += child.value
         elif isinstance(child, mecha.AstMacroLineVariable):
-            command += f'marcos.get("{child.value}").toString() + '
+            values.append(f'marcos.get("{child.value}").toString()')
+            text.append("")
             macros.append(child.value)
         else:
             raise ValueError(f"could not match macro {child}")
-    walker.output = f"dispatcher.execute(dispatcher.parse({command[:-3]}, source));"
+    key = walker.parser.serialize(walker.command)
+    name = f"macro_{digest(key)}"
+    if key not in walker.depots.macro:
+        literals = ", ".join('"%s"' % part.replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$') for part in text)
+        walker.depots.macro[key] = f"static final MacroLine {name} = new MacroLine({literals});\n"
+    walker.output = [f"result = {name}.execute(source, dispatcher, {', '.join(values)});"]
     walker.macros = macros
     walker.reqiures_macros = True
     walker.reqiures_dispatcher = True
 
+@command("say")
 def say(walker: Walker):
     template = """
         PlayerChatMessage chatMessage;
@@ -743,51 +1156,59 @@ def say(walker: Walker):
             chatMessage = PlayerChatMessage.system("{text}");
         PlayerList playerList = source.getServer().getPlayerList();
         playerList.broadcastChatMessage(chatMessage, source, ChatType.bind(ChatType.SAY_COMMAND, source));
+        result = 1;
     """
     def message(node: mecha.AstMessage):
-        walker.output = template.format(text=node.fragments[0].value)
+        walker.output = [template.format(text=node.fragments[0].value)]
     walker.next(message=message)
 
+@command("tp", "teleport")
 def tp(walker: Walker):
-    end = ""
+    # like the command, the result is how many entities were teleported
+    end = "result = 1;\n"
     def location(node: mecha.AstVector3):
         value = vec3("source.getAnchor().apply(source)", "source.getRotation()", node)  
-        walker.output += f"source.getEntityOrException().setPos({value});\n"
+        walker.emit(f"source.getEntityOrException().setPos({value});\n")
         walker.next(facing=lambda: facing(walker))
     def targets(node: mecha.AstNode):
         nonlocal end
         value = selector(node, walker, False)
-        walker.output += f"""
+        walker.emit(f"""
             for (entity in {value}) {{
                 source = source.withEntity(entity);
-            """
+                result++;
+            """)
+        end = ""
         end += "}"
         walker.next(location=location, destination=destination)
     def destination(node: mecha.AstNode):
-        walker.output += f"source.getEntityOrException().setPos({selector(node, walker, single=True)}.position());\n"
+        walker.emit(f"source.getEntityOrException().setPos({selector(node, walker, single=True)}.position());\n")
     walker.next(location=location, targets=targets)
-    walker.output += end
+    walker.emit(end)
     
+@command("kill")
 def kill(walker: Walker):
     has_targets = False
     def targets(node: mecha.AstNode):
         nonlocal has_targets
         has_targets = True
         value = selector(node, walker, False)
-        walker.output += f"""
+        walker.emit(f"""
             for (entity in {value}) {{
                 entity.kill();
+                result++;
             }}
-        """
+        """)
     walker.next(targets=targets)
     if not has_targets:
-        walker.output += "source.getEntityOrException().kill();"
+        walker.emit("source.getEntityOrException().kill();\nresult = 1;\n")
     
+@command("give")
 def give(walker: Walker):
     count_ = 1
     stack = None
     def targets(node: mecha.AstNode):
-        walker.output += f"for (player in {selector(node, walker, single=False, player=True)}) {{\n"
+        walker.emit(f"for (player in {selector(node, walker, single=False, player=True)}) {{\n")
     def item(node: mecha.AstItemStack):
         nonlocal stack
         stack = item_stack(node, walker, count="%i")
@@ -797,35 +1218,177 @@ def give(walker: Walker):
     walker.next(targets=targets)
     walker.next(item=item)
     walker.next(count=count)
-    walker.output += f"player.getInventory().add({stack %count_});\n}}"
+    walker.emit(f"player.getInventory().add({stack %count_});\nresult++;\n}}")
         
+@command("function")
 def function(walker: Walker):
-    call: str = None
-    macros = "new CompoundTag()"
+    target: mecha.AstResourceLocation = None
+    macros = "NO_MACROS"
     def name(node: mecha.AstResourceLocation):
-        nonlocal call
-        call = run_function(node, walker, macros="{0}")
+        nonlocal target
+        target = node
         walker.next(**{"with": with_, "arguments": arguments})
     def with_():
         nonlocal macros
-        macros = access_data(walker)
-        def path(node: mecha.AstNbtPath):
-            nonlocal macros
-            macros = "(CompoundTag) " + nbt_path(macros, node, walker, single=True)
-        walker.next(path=path)
+        macros = access_data(walker, lambda data, node: "(CompoundTag) " + nbt_path(data, node, walker, single=True))
     def arguments(node: mecha.AstNbtCompound):
         nonlocal macros
         macros = nbt(node, walker)
     walker.next(name=name)
-    walker.output += call.format(macros)
+    # at the end of `execute store` the functions that return report to it themselves
+    walker.emit(run_function(target, walker, macros=macros, callback="source.callback()" if walker.stored else "CommandResultCallback.EMPTY"))
     walker.reqiures_dispatcher = True
+    if not target.is_tag and macros == "NO_MACROS" and function_id(target) in walker.pack.functions:
+        walker.depots.inline[walker.parser.serialize(walker.command)] = function_id(target)
+
+@command("data")
+def data(walker: Walker):
+    def get():
+        path = None
+        def read(data: str, node: mecha.AstNbtPath) -> str:
+            nonlocal path
+            path = nbt_path_argument(node, walker)
+            return data
+        data = access_data(walker, read)
+        if path is None:
+            walker.emit(f"Objects.requireNonNull({data});\nresult = 1;\n")
+            return
+        scale = walker.next(scale=lambda node: node.value)
+        walker.emit(f"result = dataGet({data}, {path}{'' if scale is None else f', {scale}'});\n")
+    def merge():
+        accessor = data_accessor(walker)
+        value = walker.next(nbt=lambda node: nbt(node, walker))
+        walker.emit(f"""
+            var accessor = {accessor};
+            var data = accessor.getData();
+            var merged = data.copy().merge({value});
+            if (data.equals(merged))
+                throw DATA_UNCHANGED.create();
+            accessor.setData(merged);
+            result = 1;
+            """)
+    def change(operation: Callable[[str], str], sources: str | None = None):
+        """Applies `operation` to the target data, with the tags `sources` evaluates to once the data is read"""
+        walker.emit(f"""
+            var accessor = {accessor};
+            var data = accessor.getData();
+            {'' if sources is None else f'List<Tag> sources = {sources};'}
+            int changed = {operation("data")};
+            if (changed == 0)
+                throw DATA_UNCHANGED.create();
+            accessor.setData(data);
+            result = changed;
+            """)
+    def remove():
+        nonlocal accessor
+        accessor = data_accessor(walker)
+        path = walker.next(path=lambda node: nbt_path_argument(node, walker))
+        change(lambda data: f"{path}.remove({data})")
+    def modify():
+        nonlocal accessor
+        accessor = data_accessor(walker)
+        path = walker.next(targetPath=lambda node: nbt_path_argument(node, walker))
+        operation = walker.next(
+            set=lambda: lambda data: f"{path}.set({data}, sources.get(sources.size() - 1))",
+            merge=lambda: lambda data: f"dataMerge({data}, {path}, sources)",
+            append=lambda: lambda data: f"{path}.insert(-1, {data}, sources)",
+            prepend=lambda: lambda data: f"{path}.insert(0, {data}, sources)",
+            insert=lambda: walker.next(index=lambda node: lambda data: f"{path}.insert({node.value}, {data}, sources)"),
+        )
+        def value():
+            return f"List.of({walker.next(value=lambda node: nbt(node, walker))})"
+        def from_():
+            source = data_accessor(walker)
+            source_path = walker.next(sourcePath=lambda node: nbt_path_argument(node, walker))
+            if source_path is None:
+                return f"List.of({source}.getData())"
+            return f"{source_path}.get({source}.getData())"
+        change(operation, walker.next(value=value, **{"from": from_}))
+    accessor = None
+    walker.next(get=get, merge=merge, remove=remove, modify=modify)
+
+"""`scoreboard players operation` -> the new score of the target from its score `a` and the source score `b`, `><` swaps them instead"""
+SCORE_OPERATIONS = {
+    "=": "b",
+    "+=": "a + b",
+    "-=": "a - b",
+    "*=": "a * b",
+    "/=": "b == 0 ? a : Math.floorDiv(a, b)",
+    "%=": "b == 0 ? a : Math.floorMod(a, b)",
+    "<": "Math.min(a, b)",
+    ">": "Math.max(a, b)",
+    "><": "b",
+}
+
+@command("scoreboard")
+def scoreboard(walker: Walker):
+    def change(operation: str):
+        targets = walker.next(targets=lambda node: node)
+        objective = walker.next(objective=lambda node: scoreboard_lookup("Objective", node.value, walker))
+        value = walker.next(score=lambda node: node.value)
+        holders, start, end = score_holders(targets, "holder", walker)
+        walker.emit(f"""
+            var scoreboard = source.getServer().getScoreboard();
+            var scoreObjective = objective({objective}, source.getServer(), true);
+            {holders}
+            {start}
+            var score = scoreboard.getOrCreatePlayerScore(holder, scoreObjective);
+            """)
+        if operation == "set":
+            walker.emit(f"score.set({value});\n")
+        else:
+            walker.emit(f"score.add({value if operation == 'add' else -value});\n")
+        walker.emit(f"result += score.get();\n{end}")
+    def operation():
+        targets = walker.next(targets=lambda node: node)
+        target_objective = walker.next(targetObjective=lambda node: scoreboard_lookup("Objective", node.value, walker))
+        operation = walker.next(operation=lambda node: node.value)
+        sources = walker.next(source=lambda node: node)
+        source_objective = walker.next(sourceObjective=lambda node: scoreboard_lookup("Objective", node.value, walker))
+        target_holders, target_start, target_end = score_holders(targets, "target", walker)
+        source_holders, source_start, source_end = score_holders(sources, "holder", walker)
+        walker.emit(f"""
+            var scoreboard = source.getServer().getScoreboard();
+            var targetObjective = objective({target_objective}, source.getServer(), true);
+            var sourceObjective = objective({source_objective}, source.getServer(), false);
+            {target_holders}
+            {source_holders}
+            {target_start}
+            var targetScore = scoreboard.getOrCreatePlayerScore(target, targetObjective);
+            {source_start}
+            var sourceScore = scoreboard.getOrCreatePlayerScore(holder, sourceObjective);
+            int a = targetScore.get();
+            int b = sourceScore.get();
+            targetScore.set({SCORE_OPERATIONS[operation]});
+            {'sourceScore.set(a);' if operation == '><' else ''}
+            {source_end}
+            result += targetScore.get();
+            {target_end}
+            """)
+    walker.next(players=lambda: walker.next(
+        set=lambda: change("set"),
+        add=lambda: change("add"),
+        remove=lambda: change("remove"),
+        operation=operation,
+    ))
 
+"""What `execute at` changes about the source for `entity`"""
+AT_ENTITY = ".withPosition(entity.position()).withRotation(entity.getRotationVector()).withLevel((ServerLevel) entity.level())"
+
+@command("execute")
 def execute(walker: Walker):
     end = "" 
-    def fork(entities: str, statement = "source = source.withEntity(entity);") -> str:
+    def fork(entities: str, statement = "source = origin.withEntity(entity);\n") -> str:
+        """Runs the rest of the chain once for every entity, `statement` derives the source for it from `origin`"""
         nonlocal end
-        end = "});\n" + end
-        return f"{entities}.forEach(entity -> {{\n{statement}\n"
+        end = "}\n" + end
+        return f"""
+            var origin = source;
+            var entities = {entities};
+            for (int i = 0; i < entities.size(); i++) {{
+                Entity entity = entities.get(i);
+                {statement}
+            """
     def optional(entity: str) -> str:
         nonlocal end
         end = "}\n" + end
@@ -835,21 +1398,84 @@ def execute(walker: Walker):
             """
     # ------------
     def subcommand(cmd: mecha.AstCommand):
+        if walker.stored and not cmd.identifier.startswith("execute:"):
+            return stored(cmd)
         statement, _, subwalker = compile(
             cmd, 
             walker.parser, 
             walker.depots, 
-            walker.functions
+            walker.pack,
+            stored=walker.stored,
         )
         if subwalker.returns == True or subwalker.returns == Maybe: 
             subwalker.returns = Maybe
             if walker.returns == True:
-                walker.output += statement.replace("return ", "return new MaybeReturn(true, ", 1).replace(";", ");", 1)
+                walker.emit(statement.replace("return ", "return new MaybeReturn(true, ", 1).replace(";", ");", 1))
         else:
-            walker.output += statement
+            walker.emit(statement)
         walker.reqiures_dispatcher = subwalker.reqiures_dispatcher
         walker.reqiures_macros = subwalker.reqiures_macros
         return True
+    def stored(cmd: mecha.AstCommand):
+        """
+        The command at the end of a chain with `execute store`, its result is reported to the callback `store` put on the source.
+        It may fall back on its own, the dispatcher returns the same result the command would report.
+        """
+        if cmd.identifier.startswith("function:"):
+            # only a function that returns reports, which it does itself
+            statement, _, subwalker = compile(cmd, walker.parser, walker.depots, walker.pack, stored=True)
+            walker.emit(statement)
+            walker.reqiures_dispatcher = subwalker.reqiures_dispatcher
+            walker.reqiures_macros = subwalker.reqiures_macros
+            return True
+        statement, _, subwalker = compile(cmd, walker.parser, walker.depots, walker.pack)
+        if subwalker.returns:
+            raise NotImplementedError("execute store with a command that returns")
+        walker.emit(f"""
+            try {{
+                result = {statement.split("; // ", 1)[0]};
+            }} catch (CommandSyntaxException e) {{
+                source.callback().onFailure();
+                throw e;
+            }}
+            source.callback().onSuccess(result);
+            """)
+        walker.reqiures_dispatcher = subwalker.reqiures_dispatcher
+        walker.reqiures_macros = subwalker.reqiures_macros
+        return True
+    def store():
+        is_result = walker.next(result=lambda: "true", success=lambda: "false")
+        def score():
+            targets = walker.next(targets=lambda node: node)
+            if isinstance(targets, mecha.AstWildcard):
+                holders = "scoreHolders(new ArrayList<>(source.getServer().getScoreboard().getTrackedPlayers()))"
+            elif isinstance(targets, mecha.AstSelector) and not (targets.variable == "s" and len(targets.arguments) == 0):
+                holders = f"scoreHolders({selector(targets, walker, single=False)})"
+            else:
+                holders = f"List.of({score_holder(targets, walker)})"
+            objective = walker.next(objective=lambda node: scoreboard_lookup("Objective", node.value, walker))
+            return f"storeScore(source.getServer().getScoreboard(), {holders}, objective({objective}, source.getServer(), false), {is_result})"
+        def data(kind: str):
+            accessor = data_accessor(walker, kind)
+            path = walker.next(path=lambda node: nbt_path_argument(node, walker))
+            type = walker.next(**{type: field_of(f"STORE_{type.upper()}") for type in ("byte", "short", "int", "long", "float", "double")})
+            scale = walker.next(scale=lambda node: node.value)
+            return f"storeData({accessor}, {path}, {type}, {scale}, {is_result})"
+        def field_of(name: str) -> Callable[[], str]:
+            return lambda: name
+        def bossbar():
+            id = walker.next(id=lambda node: resource_location(node, walker))
+            max = walker.next(max=lambda: "true", value=lambda: "false")
+            return f"storeBossbar(source, {id}, {max}, {is_result})"
+        callback = walker.next(
+            score=score,
+            block=lambda: data("block"),
+            entity=lambda: data("entity"),
+            storage=lambda: data("storage"),
+            bossbar=bossbar,
+        )
+        walker.emit(f"source = source.withCallback({callback}, CommandResultCallback::chain);\n")
+        walker.stored = True
     def align():
         swizzle: str = walker.next(axes=lambda node: node.value)
         coords = {
@@ -859,25 +1485,32 @@ def execute(walker: Walker):
         }
         for char in swizzle:
             coords[char] = f"(int) {coords[char]}"
-        walker.output += f"source = source.withPosition(new Vec3({coords['x']}, {coords['y']}, {coords['z']}));\n"
+        walker.emit(f"source = source.withPosition(new Vec3({coords['x']}, {coords['y']}, {coords['z']}));\n")
     def anchored():
         anchor = walker.next(anchor=entity_anchor)
-        walker.output += f"source = source.withAnchor({anchor});\n"
+        walker.emit(f"source = source.withAnchor({anchor});\n")
     def as_():
-        walker.output += fork(walker.next(targets=lambda node: selector(node, walker, single=False)))
+        entities = walker.next(targets=lambda node: selector(node, walker, single=False))
+        def rest(cmd: mecha.AstCommand):
+            target = cmd.arguments[0] if len(cmd.arguments) > 0 else None
+            if cmd.identifier == "execute:at:targets:subcommand" and isinstance(target, mecha.AstSelector) \
+                    and target.variable == "s" and len(target.arguments) == 0:
+                # `as ... at @s` is a single pass over the entities
+                walker.emit(fork(entities, f"source = origin.withEntity(entity){AT_ENTITY};\n"))
+                return subcommand(cmd.arguments[1])
+            walker.emit(fork(entities))
+            return subcommand(cmd)
+        return walker.next(subcommand=rest)
     def at():
-        walker.output += fork(
+        walker.emit(fork(
             walker.next(targets=lambda node: selector(node, walker, single=False)), 
-            """source = source
-                    .withPosition(entity.position())
-                    .withRotation(entity.getRotationVector())
-                    .withLevel(entity.getServer().getLevel(entity.level().dimension()));\n"""
-        )
+            f"source = origin{AT_ENTITY};\n"
+        ))
     def in_():
         location = walker.next(dimension=lambda node: resource_location(node, walker))
-        walker.output += f"source = source.withLevel(source.getServer().getLevel(ResourceKey.create(Registries.DIMENSION, {location})));\n"
+        walker.emit(f"source = source.withLevel({level(location, walker)});\n")
     def on():
-        walker.output += walker.next(
+        walker.emit(walker.next(
             attacker=lambda: optional("(source.getEntityOrException() instanceof Attackable e ? Optional.ofNullable(e.getLastAttacker()) : Optional.empty())"),
             controller=lambda: "source = source.withEntity(source.getEntityOrException().getControllingPassenger());\n",
             leasher=lambda: optional("(source.getEntityOrException() instanceof Leashable e ? Optional.ofNullable(e.getLeashHolder()) : Optional.empty())"),
@@ -886,36 +1519,36 @@ def execute(walker: Walker):
             passengers=lambda: fork("source.getEntityOrException().getPassengers()"),
             target=lambda: optional("(source.getEntityOrException() instanceof Targeting e ? Optional.ofNullable(e.getTarget()) : Optional.empty())"),
             vehicle=lambda: "source = source.withEntity(source.getEntityOrException().getVehicle());\n",
-        )
+        ))
     def positioned():
         def pos(node: mecha.AstVector3):
-            walker.output += f"source = source.withPosition({vec3('source.getAnchor().apply(source)', 'source.getRotation()', node)}).withAnchor(EntityAnchorArgument.Anchor.FEET);\n"
+            walker.emit(f"source = source.withPosition({vec3('source.getAnchor().apply(source)', 'source.getRotation()', node)}).withAnchor(EntityAnchorArgument.Anchor.FEET);\n")
         def as_():
             entities = walker.next(targets=lambda node: selector(node, walker, single=False))
-            walker.output += fork(entities, "source = source.withPosition(entity.position());\n")
+            walker.emit(fork(entities, "source = origin.withPosition(entity.position());\n"))
         def over():
             map = walker.next(heightmap=heightmap)
-            walker.output += f"source = source.withPosition(Vec3.atCenterOf(source.getLevel().getHeightmapPos({map}, new BlockPos(toVec3i(source.getPosition())))));\n"
+            walker.emit(f"source = source.withPosition(Vec3.atCenterOf(source.getLevel().getHeightmapPos({map}, new BlockPos(toVec3i(source.getPosition())))));\n")
         walker.next(pos=pos, over=over, **{"as": as_})
     def rotated():
         def pos(node: mecha.AstVector2):
-            walker.output += f"source = source.withRotation({vec2('source.getRotation()', node)});\n"
+            walker.emit(f"source = source.withRotation({vec2('source.getRotation()', node)});\n")
         def as_():
             entities = walker.next(targets=lambda node: selector(node, walker, single=False))
-            walker.output += fork(entities, "source = source.withRotation(entity.getRotationVector());\n")
+            walker.emit(fork(entities, "source = origin.withRotation(entity.getRotationVector());\n"))
         walker.next(pos=pos, **{"as": as_})
     def summon():
         type = walker.next(entity=lambda node: walker.parser.serialize(node))
-        walker.output += f"""
+        walker.emit(f"""
             CompoundTag tag_tmp = new CompoundTag();
             tag_tmp.putString("id", "{type}");
-            source = source.withEntity(Objects.requireNonNull(BuiltInRegistries.ENTITY_TYPE.get(ResourceLocation.withDefaultNamespace("")).loadEntityRecursive(tag_tmp, source.getLevel(), entity -> {{
+            source = source.withEntity(Objects.requireNonNull(EntityType.loadEntityRecursive(tag_tmp, source.getLevel(), entity -> {{
                 entity.setPos(source.getPosition());
                 if (entity instanceof Mob) // randomize data ._.
                     entity.finalizeSpawn(source.getLevel(), source.getLevel().getCurrentDifficultyAt(entity.blockPosition()), MobSpawnType.COMMAND, null);
                 return entity;
             }})));
-        """
+        """)
     def if_(is_if: bool):
         condition = ""
         def biome():
@@ -923,10 +1556,10 @@ def execute(walker: Walker):
             pos = walker.next(pos=lambda node: vec3(node, vec3i=True))
             res = walker.next(biome=lambda node: (node.is_tag, resource_location(node, walker)))
             if res[0]:
-                res = f"TagKey.create(Registries.BIOME, {res[1]})"
+                res = registry_tag("BIOME", "Biome", res[1], walker)
             else:
-                res = res[1]
-            walker.output += f"var blockpos = new BlockPos({pos});\n"
+                res = resolved("ResourceKey<Biome>", "ResourceKey", f"ResourceKey.create(Registries.BIOME, {res[1]})", walker)
+            walker.emit(f"var blockpos = new BlockPos({pos});\n")
             condition += f"source.getLevel().isLoaded(blockpos) && source.getLevel().getBiome(blockpos).is({res})"
             return "result = 1;\n"
         def block():
@@ -938,46 +1571,19 @@ def execute(walker: Walker):
             return "result = 1;\n"
         def blocks():
             nonlocal condition
-            condition += "((Supplier<Boolean>) () -> {\n"
             start = walker.next(start=lambda node: vec3(node, vec3i=True))
             end = walker.next(end=lambda node: vec3(node, vec3i=True))
             destination = walker.next(destination=lambda node: vec3(node, vec3i=True))
-            if is_if: walker.output += "int totalBlocks = 0;"
-            condition += f"""
-                var original = BoundingBox.fromCorners({start}, {end});
-                Vec3i destenation = {destination};
-                Vec3i length = original.getLength();
-                var compare = BoundingBox.fromCorners(destenation, destenation.offset(original.getLength()));
-                
-                for (int x = 0; x <= length.getX(); x++)
-                    for (int y = 0; y <= length.getY(); y++)
-                        for (int z = 0; z <= length.getZ(); z++) {{
-                            var original_pos = new BlockPos(x + original.minX(), y + original.minY(), z + original.minZ());
-                            var compare_pos = new BlockPos(x + compare.minX(), y + compare.minY(), z + compare.minZ());
-                            if (!source.getLevel().isLoaded(original_pos) || !source.getLevel().isLoaded(compare_pos)) return false;
-                            var original_state = source.getLevel().getBlockState(original_pos);
-            """
-            condition += walker.next(all=lambda: "", masked=lambda: "if (original_state.isAir()) continue;\n")
-            condition += """
-                            var compare_state = source.getLevel().getBlockState(compare_pos);
-                            if (original_state != compare_state) return false; //sus
-                            var original_entity = source.getLevel().getBlockEntity(original_pos);
-                            if (original_entity == null) continue;
-                            var compare_entity = source.getLevel().getBlockEntity(compare_pos);
-                            if (compare_entity == null) return false;
-                            if (!original_entity.components().equals(compare_entity.components())) return false;
-                            %s
-                        }
-                    return true;
-                }).get()
-            """ % "totalBlocks++;" if is_if else ""
+            masked = walker.next(all=lambda: "false", masked=lambda: "true")
+            walker.emit(f"int matchingBlocks = compareBlocks(source.getLevel(), {start}, {end}, {destination}, {masked});\n")
+            condition += "matchingBlocks >= 0"
             if is_if:
-                return "result = totalBlocks;\n"
+                return "result = matchingBlocks;\n"
             else:
                 return "result = 1;\n"
         def data():
             nonlocal condition
-            walker.output += """
+            walker.emit("""
                 boolean exists;
                 int totalMatches;
                 try {
@@ -987,7 +1593,7 @@ def execute(walker: Walker):
                 } catch (NullPointerException | IndexOutOfBoundsException e) {
                     exists = false;
                 }
-            """ % nbt_path(access_data(walker), walker.next(path=lambda node: node), walker, single=False)
+            """ % access_data(walker, lambda data, node: nbt_path(data, node, walker, single=False)))
             condition += "exists"
             if is_if:
                 return "result = totalMatches;\n"
@@ -995,12 +1601,11 @@ def execute(walker: Walker):
                 return "result = 1;\n"
         def dimension():
             nonlocal condition
-            condition += "source.getLevel() == source.getServer().getLevel(ResourceKey.create(Registries.DIMENSION, %s))" \
-                % resource_location(walker.next(dimension=lambda node: node), walker)
+            condition += "source.getLevel() == %s" % level(resource_location(walker.next(dimension=lambda node: node), walker), walker)
             return "result = 1;\n"
         def entity():
             nonlocal condition
-            walker.output += "int matches = %s.size();\n" % selector(walker.next(entities=lambda node: node), walker, single=False)
+            walker.emit("int matches = %s.size();\n" % selector(walker.next(entities=lambda node: node), walker, single=False))
             condition += "matches > 0" 
             if is_if:
                 return "result = matches;\n"
@@ -1009,14 +1614,42 @@ def execute(walker: Walker):
         def function():
             nonlocal condition
             
+        def score():
+            nonlocal condition
+            target = score_holder(walker.next(target=lambda node: node), walker)
+            target_objective = walker.next(targetObjective=lambda node: scoreboard_lookup("Objective", node.value, walker))
+            walker.emit(f"""
+                var scoreboard = source.getServer().getScoreboard();
+                var targetScore = scoreboard.getPlayerScoreInfo({target}, objective({target_objective}, source.getServer(), false));
+                """)
+            def matches():
+                nonlocal condition
+                range = walker.next(range=lambda node: range_ints(node, walker))
+                condition += f"targetScore != null && {range}.matches(targetScore.value())"
+            def compare(operator: str):
+                nonlocal condition
+                holder = score_holder(walker.next(source=lambda node: node), walker)
+                source_objective = walker.next(sourceObjective=lambda node: scoreboard_lookup("Objective", node.value, walker))
+                walker.emit(f"var sourceScore = scoreboard.getPlayerScoreInfo({holder}, objective({source_objective}, source.getServer(), false));\n")
+                condition += f"targetScore != null && sourceScore != null && targetScore.value() {operator} sourceScore.value()"
+            walker.next(**{
+                "matches": matches,
+                "<": lambda: compare("<"),
+                "<=": lambda: compare("<="),
+                "=": lambda: compare("=="),
+                ">": lambda: compare(">"),
+                ">=": lambda: compare(">="),
+            })
+            return "result = 1;\n"
         out = walker.next(
             biome=biome,
             block=block,
             blocks=blocks,
             data=data,
             dimension=dimension,
+            score=score,
         )
-        walker.output += f"if ({'' if is_if else '!'}({condition})) {{\n"
+        walker.emit(f"if ({'' if is_if else '!'}({condition})) {{\n")
         nonlocal end
         end = "}\n" + end
         return out
@@ -1032,6 +1665,7 @@ def execute(walker: Walker):
         "positioned": positioned,
         "rotated": rotated,
         "summon": summon,
+        "store": store,
         "if": lambda: if_(True),
         "unless": lambda: if_(False),
         "run": lambda: None,
@@ -1041,5 +1675,8 @@ def execute(walker: Walker):
         if exists is None:
             if out is None:
                 raise NotImplementedError("'out' is 'None' despite there being no following subcommand")
-            walker.output += out
-    walker.output += end
+            walker.emit(out)
+            if walker.stored:
+                # `end` starts by closing the condition
+                walker.emit("source.callback().onSuccess(result);\n} else {\nsource.callback().onFailure();\n")
+    walker.emit(end)
@@ -1,59 +1,553 @@
 import beet, mecha
-import os, sys, shutil
+import os, sys, json, shutil, filecmp, hashlib, time
+import re as regex
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
 import commands
+from report import Report
+from emitter import write_template, open_if_changed, estimate
 from templates import *
 
+"""Changes whenever the compiler itself or the mecha and beet it parses with change, invalidates the build cache"""
+COMPILER_VERSION = hashlib.sha1(b"".join([
+    *(open(os.path.join(os.path.dirname(__file__), file), "rb").read() for file in ("compiler.py", "commands.py", "templates.py", "emitter.py")),
+    f"mecha {mecha.__version__}, beet {beet.__version__}".encode(),
+])).hexdigest()
+
+@dataclass
+class CompiledFunction:
+    body: str
+    macros: list[str]
+    depots: commands.Depots
+    """keys of the top level commands, in order"""
+    commands: list[str]
+    """seconds spent parsing and compiling, `None` when restored from the cache"""
+    seconds: float | None = None
+    """top level command identifier -> how many commands use it and the seconds spent compiling them"""
+    timings: dict[str, tuple[int, float]] = field(default_factory=dict)
+
+    def dump(self) -> dict:
+        """What's stored in the build cache, timings are left out as they don't describe the next build"""
+        return {"body": self.body, "macros": self.macros, "depots": self.depots.dump(), "commands": self.commands}
+
+    @classmethod
+    def load(cls, data: dict) -> "CompiledFunction":
+        return cls(data["body"], data["macros"], commands.Depots.load(data["depots"]), data["commands"])
+
+def compile_function(function: beet.Function | str, parser: mecha.Mecha, pack: commands.Pack) -> CompiledFunction:
+    start = time.perf_counter()
+    compiled = compile_ast(parser.parse(function), parser, pack)
+    compiled.seconds = time.perf_counter() - start
+    return compiled
+
+def compile_ast(ast: mecha.AstRoot, parser: mecha.Mecha, pack: commands.Pack) -> CompiledFunction:
+    compiled = CompiledFunction([], [], commands.Depots(), [])
+    for command in ast.commands:
+        start = time.perf_counter()
+        output, out_macros, _ = commands.compile(command, parser, compiled.depots, pack)
+        identifier = command.identifier.split(":")[0]
+        count, seconds = compiled.timings.get(identifier, (0, 0))
+        compiled.timings[identifier] = (count + 1, seconds + time.perf_counter() - start)
+        for macro in out_macros:
+            if macro in compiled.macros: continue
+            compiled.macros.append(macro)
+        compiled.body.append(output)
+        compiled.commands.append(parser.serialize(command))
+    compiled.body = "".join(compiled.body)
+    compiled.seconds = sum(seconds for _, seconds in compiled.timings.values())
+    return compiled
+
+"""State of a worker process in parallel builds"""
+worker_parser: mecha.Mecha = None
+worker_pack: commands.Pack = None
+
+def init_worker(pack: commands.Pack) -> None:
+    global worker_parser, worker_pack
+    worker_parser = mecha.Mecha()
+    worker_pack = pack
+
+def compile_in_worker(source: str) -> tuple[dict, float, dict[str, tuple[int, float]]]:
+    compiled = compile_function(source, worker_parser, worker_pack)
+    return compiled.dump(), compiled.seconds, compiled.timings
+
+def compile_parallel(sources: list[str], pack: commands.Pack, workers: int) -> list[CompiledFunction]:
+    """Results are in the same order as `sources`, merging them in that order gives the same output as a serial build"""
+    results = []
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(pack,)) as pool:
+        for data, seconds, timings in pool.map(compile_in_worker, sources, chunksize=max(1, len(sources) // (workers * 4))):
+            compiled = CompiledFunction.load(data)
+            compiled.seconds = seconds
+            compiled.timings = timings
+            results.append(compiled)
+    return results
+
+def expand_tag(data: beet.DataPack, tag: str, expanding: tuple[str, ...] = (), *, strict = True) -> list[str] | None:
+    """
+    Members of a function tag in the order they run, `None` if any of them isn't a function of this pack
+    or the tag (or one it includes) doesn't `replace`, as other datapacks could add to it
+    
+    Args:
+        strict: Whether to skip members that aren't functions of this pack instead of returning `None`.
+    """
+    if tag in expanding or tag not in data.function_tags:
+        return None if strict else []
+    if strict and not data.function_tags[tag].data.get("replace", False):
+        return None
+    members = []
+    for value in data.function_tags[tag].data.get("values", []):
+        if isinstance(value, dict):
+            value = value["id"]
+        if value.startswith("#"):
+            nested = value[1:] if ":" in value else "minecraft:" + value[1:]
+            ids = expand_tag(data, nested, expanding + (tag,), strict=strict)
+            if ids is None:
+                return None
+        else:
+            ids = [value if ":" in value else "minecraft:" + value]
+            if ids[0] not in data.functions:
+                if not strict:
+                    continue
+                return None
+        for id in ids:
+            if id not in members:
+                members.append(id)
+    return members
+
+"""Files written by `write_entry_point` for each shard"""
+SHARD_FILE = regex.compile(r"Shard_(\d+)\.groovy")
+
+"""Function ids in commands the compiler left to the dispatcher, like `schedule function` or `execute if function`"""
+FUNCTION_REFERENCE = regex.compile(r"\bfunction (#?[\w.:/-]+)")
+
+def referenced_functions(data: beet.DataPack, value) -> set[str]:
+    """Functions a json resource can run, from `function` fields (advancement rewards, enchantment effects) and commands in its strings (click events, dialogs)"""
+    out = set()
+    pending = [value]
+    while len(pending) > 0:
+        value = pending.pop()
+        if isinstance(value, dict):
+            function = value.get("function")
+            if isinstance(function, str):
+                out.add(function if ":" in function else "minecraft:" + function)
+            pending.extend(value.values())
+        elif isinstance(value, list):
+            pending.extend(value)
+        elif isinstance(value, str):
+            for reference in FUNCTION_REFERENCE.findall(value):
+                if reference.startswith("#"):
+                    out.update(expand_tag(data, reference[1:] if ":" in reference else "minecraft:" + reference[1:], strict=False))
+                else:
+                    out.add(reference if ":" in reference else "minecraft:" + reference)
+    return out
+
+def reachable_functions(data: beet.DataPack, roots: set[str]) -> set[str]:
+    """Functions of the pack `roots` can run, following the function commands in their source"""
+    reached = set()
+    pending = list(roots)
+    while len(pending) > 0:
+        function_id = pending.pop()
+        if function_id in reached or function_id not in data.functions:
+            continue
+        reached.add(function_id)
+        pending.extend(referenced_functions(data, data.functions[function_id].text))
+    return reached
+
+def entry_points(data: beet.DataPack, extra: list[str]) -> set[str]:
+    """
+    Functions that run without being called by another function: the load and tick tags, `extra` (function ids or `#tags`)
+    and whatever other resources of the pack reference, like advancement rewards or enchantment effects
+    """
+    roots = set()
+    for root in ["#minecraft:load", "#minecraft:tick", *extra]:
+        if root.startswith("#"):
+            roots.update(expand_tag(data, root[1:], strict=False))
+        else:
+            roots.add(root)
+    for _, resource in data.all():
+        # function tags only run through the functions that call them or the tags above
+        if isinstance(resource, beet.JsonFileBase) and not isinstance(resource, beet.FunctionTag):
+            roots |= referenced_functions(data, resource.data)
+    return roots
+
+def called_functions(data: beet.DataPack, compiled: CompiledFunction) -> set[str] | None:
+    """Functions `compiled` can call, `None` if a macro line might call any function"""
+    callees = set(compiled.depots.calls)
+    for tag in compiled.depots.tags:
+        callees.update(expand_tag(data, tag, strict=False))
+    for command in compiled.depots.fallbacks:
+        callees |= referenced_functions(data, command)
+    for line in compiled.depots.macro.contents:
+        if "function" in line:
+            return None
+    return callees
+
+def recursive_functions(graph: dict[str, set[str]]) -> set[str]:
+    """Functions of `graph` (function id -> callees) that can end up calling themselves, found as the strongly connected components of the call graph"""
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    out = set()
+    for root in graph:
+        if root in index:
+            continue
+        # iterative tarjan, call chains easily get deeper than python's recursion limit
+        work = [(root, iter(graph[root]))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, callees = work[-1]
+            for callee in callees:
+                if callee not in graph:
+                    continue
+                if callee not in index:
+                    index[callee] = low[callee] = len(index)
+                    stack.append(callee)
+                    on_stack.add(callee)
+                    work.append((callee, iter(graph[callee])))
+                    break
+                if callee in on_stack:
+                    low[node] = min(low[node], index[callee])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in graph[node]:
+                        out.update(component)
+    return out
+
+"""How many times more commands the `inline` limit allows for functions the profile shows run more often than average"""
+HOT_INLINE = 4
+
+def inline_functions(functions: dict[str, CompiledFunction], graph: dict[str, set[str]], limit: int, hot: set[str] = frozenset()) -> dict[str, str]:
+    """
+    function id -> its body with calls to other compiled functions replaced by the body of the callee.
+    Only callees without macros, without commands that return and with at most `limit` commands (`HOT_INLINE` times that for `hot` ones) are inlined, recursive functions always stay calls.
+    """
+    recursive = recursive_functions(graph)
+    bodies = {}
+    def callee(compiled: CompiledFunction, line: str) -> str | None:
+        """The function `line` calls if it can be inlined, calls to them never lead back to the caller as recursive functions are left out"""
+        if line.startswith(("return ", "if (")):
+            return None
+        callee = compiled.depots.inline.get(line.split("; // ", 1)[-1].rstrip("\n"))
+        if callee in functions and callee not in recursive and len(functions[callee].macros) == 0:
+            return callee
+        return None
+    def expand(function_id: str) -> str:
+        """The body of `function_id`, once every callee it could inline is expanded"""
+        compiled = functions[function_id]
+        out = []
+        for line in compiled.body.splitlines(keepends=True):
+            called = callee(compiled, line)
+            if called is not None:
+                body = bodies[called]
+                lines = body.splitlines()
+                if len(lines) <= (limit * HOT_INLINE if called in hot else limit) and not any(line.startswith(("return ", "if (")) for line in lines):
+                    out.append(body)
+                    continue
+            out.append(line)
+        return "".join(out)
+    # callees are expanded before their callers, with a stack instead of recursion as call chains can be long
+    for function_id in functions:
+        stack = [function_id]
+        while len(stack) > 0:
+            current = stack[-1]
+            if current in bodies:
+                stack.pop()
+                continue
+            compiled = functions[current]
+            called = (callee(compiled, line) for line in compiled.body.splitlines())
+            pending = [function for function in called if function is not None and function not in bodies]
+            if len(pending) > 0:
+                stack.extend(pending)
+                continue
+            bodies[current] = expand(current)
+            stack.pop()
+    return bodies
+
+def compile_functions(functions: list[tuple[str, beet.Function]], pack: commands.Pack, parser: mecha.Mecha, cache: dict | None, workers: int) -> dict[str, tuple[str, CompiledFunction]]:
+    """function id -> the key of its source in the cache and the compiled function, restored from `cache` where possible"""
+    results = {}
+    pending = []
+    for function_id, function in functions:
+        key = hashlib.sha1(function.text.encode()).hexdigest()
+        entry = cache["functions"].get(key) if cache is not None else None
+        restored = CompiledFunction.load(entry) if entry is not None else None
+        if restored is not None and pack.is_valid(restored.depots):
+            results[function_id] = (key, restored)
+        else:
+            pending.append((function_id, key, function))
+    if workers > 1 and len(pending) > 1:
+        compiled = compile_parallel([function.text for _, _, function in pending], pack, workers)
+    else:
+        compiled = [compile_function(function, parser, pack) for _, _, function in pending]
+    for (function_id, key, _), result in zip(pending, compiled):
+        results[function_id] = (key, result)
+    return results
+
+def sync_tree(source: str, destination: str) -> None:
+    """Only copies files that changed, keeps everything else (like gradle's build directory) in place"""
+    for root, _, files in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target, exist_ok=True)
+        for file in files:
+            src = os.path.join(root, file)
+            dst = os.path.join(target, file)
+            if not os.path.isfile(dst) or not filecmp.cmp(src, dst, shallow=False):
+                shutil.copy2(src, dst)
+
+def split_function(body: str, budget: int, overhead: int = 0) -> list[str]:
+    """Splits the body of a function into runs of whole commands that each stay within `budget`, every command is a single line that later grows by `overhead`"""
+    parts = [[]]
+    size = 0
+    for line in body.splitlines(keepends=True):
+        cost = estimate(line) + overhead
+        if len(parts[-1]) > 0 and size + cost > budget:
+            parts.append([])
+            size = 0
+        parts[-1].append(line)
+        size += cost
+    return ["".join(part) for part in parts]
+
+def function_part(body: str) -> str:
+    """A part of a split function returns a `MaybeReturn` so the function knows whether one of its commands returned"""
+    out = []
+    for line in body.splitlines(keepends=True):
+        if line.startswith("return "):
+            statement, comment = line[len("return "):].split(";", 1)
+            line = f"return new MaybeReturn(true, {statement});{comment}"
+        elif line.startswith("if ("):
+            line = line.replace("return integer;", "return new MaybeReturn(true, integer);", 1)
+        out.append(line)
+    return "".join(out)
+
+"""Estimated bytecode `instrument` adds to every command"""
+PROFILE_COST = estimate("long start_0 = System.nanoTime(); try { } finally { profile(0, start_0); }")
+
+def profile_keys(function_id: str, body: str) -> list[str]:
+    """The profile keys of a function and each of its commands, a command's key is the function id and the command on the next line"""
+    return [function_id, *(f"{function_id}\n{line.split('; // ', 1)[1]}" for line in body.splitlines())]
+
+def instrument(body: str, function_id: str, counters: dict[str, int]) -> str:
+    """Times every command of `body` with the counter of its key, counters are added to `counters` (profile key -> index) as needed"""
+    out = []
+    for i, line in enumerate(body.splitlines()):
+        statement, key = line.split("; // ", 1)
+        counter = counters.setdefault(f"{function_id}\n{key}", len(counters))
+        out.append(f"long start_{i} = System.nanoTime(); try {{ {statement}; }} finally {{ profile({counter}, start_{i}); }} // {key}\n")
+    return "".join(out)
+
+def load_profile(path: str) -> tuple[dict[str, dict], int]:
+    """function id -> how often it ran and how long that took, from the file an instrumented build writes, and how many ticks the server ran"""
+    with open(path) as f:
+        profile = json.load(f)
+    return profile["functions"], profile.get("ticks", 0)
+
+def write_entry_point(directory: str, name: str, functions: list[tuple[str, str]], depots: commands.Depots, macro_cache: int = 256, budget: int = 8000, profile: str | None = None) -> None:
+    """
+    Writes `EntryPoint.groovy` and the shards holding the compiled code to `directory`.
+    `functions` holds the id and compiled body of every compiled function, their position is the index the datapack calls them with.
+    `macro_cache` is how many parsed macro lines the runtime keeps, `budget` the estimated bytecode size no generated method should exceed.
+    With a `profile` path every function and command counts its executions and time, the server writes them there when it stops.
+    """
+    shards = [(part, []) for part in depots.shard(budget)]
+    size = budget * commands.CLASS_BUDGET
+    counters = {}
+    # registering a function is a line in a method of the shard that holds it, which has to stay within the budget as well
+    registered = budget
+    for index, (function_id, body) in enumerate(functions):
+        method = commands.function_method(function_id)
+        parts = split_function(body, budget, PROFILE_COST if profile is not None else 0)
+        cost = sum(map(estimate, parts))
+        keys = []
+        if profile is not None:
+            # the shard also names the counters of its functions, so no single method holds every key
+            for key in profile_keys(function_id, body):
+                if key not in counters:
+                    counters[key] = len(counters)
+                    literal = key.replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n")
+                    keys.append(f"PROFILE_KEYS[{counters[key]}] = '{literal}';\n")
+        entry = estimate(f'registerFunction({index}, "{function_id}", Shard_0::{method});') + sum(map(estimate, keys))
+        if size + cost + entry > budget * commands.CLASS_BUDGET or registered + entry > budget:
+            shards.append((commands.Depots(), []))
+            size = 0
+            registered = 0
+        size += cost + entry
+        registered += entry
+        register = "".join([f'registerFunction({index}, "{function_id}", Shard_{len(shards) - 1}::{method});\n', *keys])
+        shards[-1][1].append((function_id, method, parts, register))
+    def write_functions(members):
+        def write(out):
+            for function_id, method, parts, _ in members:
+                def body(code: str) -> str:
+                    if profile is None:
+                        return code
+                    counter = counters[function_id]
+                    return f"long start = System.nanoTime();\ntry {{\n{code}return 0;\n}} finally {{\nprofile({counter}, start);\n}}\n"
+                if len(parts) == 1:
+                    write_template(out, function_template, function=function_id, method=method, body=body(instrument(parts[0], function_id, counters) if profile is not None else parts[0]))
+                    continue
+                calls = []
+                for i, part in enumerate(parts):
+                    part = function_part(part)
+                    if profile is not None:
+                        part = instrument(part, function_id, counters)
+                    write_template(out, function_part_template, function=function_id, part=i, method=f"{method}_{i}", body=part)
+                    calls.append(f"if ({method}_{i}(source, marcos, dispatcher).out() instanceof Integer integer) return integer;\n")
+                write_template(out, function_template, function=function_id, method=method, body=body("".join(calls)))
+        return write
+    for i, (part, members) in enumerate(shards):
+        with open_if_changed(os.path.join(directory, f"Shard_{i}.groovy")) as f:
+            write_template(f, shard_template,
+                name=name,
+                imports=imports,
+                shard=f"Shard_{i}",
+                shard_imports="\n".join(f"import static datapack.{name}.Shard_{j}.*;" for j in range(len(shards)) if j != i),
+                depots=part.package,
+                functions=write_functions(members),
+                register="".join(register for *_, register in members),
+            )
+    for file in os.listdir(directory):
+        match = SHARD_FILE.fullmatch(file)
+        if match is not None and int(match.group(1)) >= len(shards):
+            os.remove(os.path.join(directory, file))
+    with open_if_changed(os.path.join(directory, "EntryPoint.groovy")) as f:
+        write_template(f, entry_point_template,
+            name=name,
+            imports=imports,
+            macro_cache=macro_cache,
+            resolve_on_start="\n".join(f"Shard_{i}.resolveOnStart(server);" for i in range(len(shards))),
+            profile=profile_template.format(
+                count=len(counters),
+                file=profile.replace("\\", "\\\\").replace('"', '\\"'),
+            ) if profile is not None else "",
+            on_stop="ServerLifecycleEvents.SERVER_STOPPING.register(server -> writeProfile(server));" if profile is not None else "",
+            count=len(functions),
+            register="\n".join(f"Shard_{i}.registerFunctions();" for i, (_, members) in enumerate(shards) if len(members) > 0),
+        )
+
 def beet_default(ctx: beet.Context):
+    options = ctx.meta.get("compiler", {})
+    cache = None
+    if options.get("cache", True):
+        cache = ctx.cache["compiler"].json
+        if cache.get("version") != COMPILER_VERSION:
+            cache.clear()
+            cache["version"] = COMPILER_VERSION
+        cache.setdefault("functions", {})
     depots = commands.Depots()
     parser = mecha.Mecha()
     name = ctx.project_id
-    functions = ""
-    compiled_list = ""
+    functions = []
     to_compile = []
     for function_id, function in ctx.data.functions.items():
         if "#no_compile" not in function.lines:
             to_compile.append((function_id, function))
-            compiled_list += f'"{function_id}",\n'
+    profile = None
+    if options.get("profile"):
+        if os.path.isfile(options["profile"]):
+            profile, ticks = load_profile(options["profile"])
+        else:
+            print(f"WARNING: there is no profile at {options['profile']}, build with `instrument` and run the server to record one")
+    if profile is not None and ticks >= options.get("profile_ticks", 12000):
+        # the profiled run never got to these, compiling them only costs build time and class size
+        # functions nothing in the pack calls are run from outside it, a profile says nothing about whether they will
+        reachable = reachable_functions(ctx.data, entry_points(ctx.data, options.get("entry_points", [])))
+        cold = {function_id for function_id, _ in to_compile if function_id in reachable and profile.get(function_id, {}).get("count", 1) == 0}
+        if len(cold) > 0:
+            print(f"{len(cold)} functions never ran while profiling and stay interpreted")
+        to_compile = [function for function in to_compile if function[0] not in cold]
+    elif profile is not None:
+        print(f"WARNING: the profile only covers {ticks} ticks, every function is compiled")
+    pack = commands.Pack({function_id for function_id, _ in to_compile})
+    for tag in list(ctx.data.function_tags):
+        members = expand_tag(ctx.data, tag)
+        if members is not None:
+            pack.tags[tag] = members
+    workers = options.get("workers", 1)
+    used = {}
+    if options.get("prune", False):
+        # only what can run gets compiled, in waves of the functions called by the previous wave
+        reached = entry_points(ctx.data, options.get("entry_points", []))
+        results = {}
+        while True:
+            wave = [(function_id, function) for function_id, function in to_compile if function_id in reached and function_id not in results]
+            if len(wave) == 0:
+                break
+            results.update(compile_functions(wave, pack, parser, cache, workers))
+            for function_id, _ in wave:
+                callees = called_functions(ctx.data, results[function_id][1])
+                if callees is None:
+                    print(f"WARNING: {function_id} might call any function with a macro, nothing is pruned")
+                    callees = pack.functions
+                reached |= callees
+        pruned = [function for function in to_compile if function[0] not in results]
+        if len(pruned) > 0:
+            print(f"{len(pruned)} functions are never called and stay interpreted")
+        for _, function in pruned:
+            key = hashlib.sha1(function.text.encode()).hexdigest()
+            if cache is not None and key in cache["functions"]:
+                used[key] = cache["functions"][key]
+        to_compile = [function for function in to_compile if function[0] in results]
+    else:
+        results = compile_functions(to_compile, pack, parser, cache, workers)
+    bodies = {function_id: results[function_id][1].body for function_id, _ in to_compile}
+    # instrumented builds keep every call so the profile is attributed to the functions as they are written
+    if options.get("inline", 8) > 0 and not options.get("instrument"):
+        compiled = {function_id: results[function_id][1] for function_id, _ in to_compile}
+        graph = {}
+        for function_id, function in compiled.items():
+            callees = called_functions(ctx.data, function)
+            graph[function_id] = set(compiled) if callees is None else callees
+        hot = set()
+        if profile is not None:
+            counts = [profile[function_id]["count"] for function_id in compiled if function_id in profile]
+            average = sum(counts) / max(1, len(counts))
+            hot = {function_id for function_id in compiled if function_id in profile and profile[function_id]["count"] >= average}
+        bodies = inline_functions(compiled, graph, options.get("inline", 8), hot)
+    report = Report() if options.get("report") else None
     for function_id, function in to_compile:
-        ast = parser.parse(function)
-        macros = []
-        body = ""
-        for command in ast.commands:
-            output, out_macros, _ = commands.compile(command, parser, depots, to_compile)
-            for macro in out_macros:
-                if macro in macros: continue
-                macros.append(macro)
-            body += output
-        functions += function_template.format(
-            function=function_id, 
-            body=body
-        )
-        function_execution = f"_function__{ctx.project_id} \"{function_id}\" {{"
-        if (len(macros) > 0): 
-            function_execution = "$" + function_execution
-            for macro in macros:
+        key, compiled = results[function_id]
+        if cache is not None and key not in used:
+            # a cached entry that was no longer valid got recompiled, so this is always the current one
+            used[key] = compiled.dump()
+        if report is not None:
+            report.add(function_id, compiled)
+        depots.merge(compiled.depots)
+        function_execution = f"_function__{ctx.project_id} {len(functions)}"
+        functions.append((function_id, bodies[function_id]))
+        if (len(compiled.macros) > 0):
+            function_execution = "$" + function_execution + " {"
+            for macro in compiled.macros:
                 function_execution += f"\"{macro}\": $({macro}), "
-            function_execution = function_execution[:-2]
-        function.lines = [function_execution + "}"]
-    shutil.rmtree("out")
-    shutil.copytree("template", "out")
-    os.makedirs(os.path.join("out/src/main/java/datapack/", name))
-    with open("out/src/main/java/datapack/" + name + "/EntryPoint.groovy", "x") as f:
-        if len(compiled_list) > 0:
-            compiled_list = compiled_list[:-2]
-        else:
-            print("WARNING: nothing was compiled")
-        f.write(entry_point_template.format(
-            name=name,
-            commands=functions,
-            depots=depots.package(),
-            to_compile=compiled_list
-        ))
-    with open("out/src/main/resources/fabric.mod.json", "x") as f:
+            function_execution = function_execution[:-2] + "}"
+        function.lines = [function_execution]
+    depots.prune(body for _, body in functions)
+    if report is not None:
+        report.write(options["report"])
+        print(report.summary())
+    if cache is not None:
+        cache["functions"] = used
+    sync_tree("template", "out")
+    os.makedirs(os.path.join("out/src/main/java/datapack/", name), exist_ok=True)
+    if len(to_compile) == 0:
+        print("WARNING: nothing was compiled")
+    write_entry_point("out/src/main/java/datapack/" + name, name, functions, depots, options.get("macro_cache", 256), options.get("bytecode_budget", 8000), options.get("instrument") or None)
+    with open_if_changed("out/src/main/resources/fabric.mod.json") as f:
         f.write(mod_config_template.format(
             name=name,
             desc=ctx.project_description,
             title=ctx.project_name,
             version=ctx.project_version,
             author=ctx.project_author
-        ))        
+        ))
@@ -0,0 +1,43 @@
+import os, filecmp, string
+import re as regex
+from typing import TextIO, Callable, Iterator
+from contextlib import contextmanager
+
+"""A section is either text or something that writes the section into the given output itself"""
+Section = str | Callable[[TextIO], None]
+
+formatter = string.Formatter()
+
+COMMENT = regex.compile(r"//[^\n]*|/\*.*?\*/", regex.DOTALL)
+TOKEN = regex.compile(r"\"(?:\\.|[^\"\\])*\"|\w+|[^\s\w]")
+
+def estimate(code: str) -> int:
+    """Rough upper bound of the bytecode `code` compiles to, about three bytes for every token that isn't part of a comment"""
+    return 3 * len(TOKEN.findall(COMMENT.sub("", code)))
+
+def write_template(out: TextIO, template: str, **sections: Section) -> None:
+    """Same as `out.write(template.format(**sections))` without ever holding the formatted result in memory"""
+    for text, field, _, _ in formatter.parse(template):
+        out.write(text)
+        if field is None:
+            continue
+        section = sections[field]
+        if callable(section):
+            section(out)
+        else:
+            out.write(str(section))
+
+@contextmanager
+def open_if_changed(path: str) -> Iterator[TextIO]:
+    """Streams into a temporary file that only replaces `path` if the contents differ, so gradle doesn't recompile unchanged sources"""
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            yield f
+    except BaseException:
+        os.remove(tmp)
+        raise
+    if os.path.isfile(path) and filecmp.cmp(tmp, path, shallow=False):
+        os.remove(tmp)
+    else:
+        os.replace(tmp, path)
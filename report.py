@@ -0,0 +1,71 @@
+import json
+from dataclasses import dataclass, field
+
+NATIVE = "native"
+PARTIAL = "partial"
+INTERPRETED = "interpreted"
+
+@dataclass
+class Report:
+    """Where compile time goes and which commands still run through the dispatcher"""
+    functions: dict[str, dict] = field(default_factory=dict)
+    """top level command identifier -> how often it was compiled and how long that took"""
+    commands: dict[str, dict] = field(default_factory=dict)
+    """reason -> how many commands fell back because of it"""
+    fallbacks: dict[str, int] = field(default_factory=dict)
+
+    def add(self, function_id: str, compiled) -> None:
+        """`compiled` is a `compiler.CompiledFunction`"""
+        fallbacks = compiled.depots.fallbacks
+        interpreted = sum(1 for key in compiled.commands if key in fallbacks)
+        if len(fallbacks) == 0:
+            status = NATIVE
+        elif interpreted == len(compiled.commands):
+            status = INTERPRETED
+        else:
+            status = PARTIAL
+        self.functions[function_id] = {
+            "status": status,
+            "cached": compiled.seconds is None,
+            "seconds": compiled.seconds,
+            "commands": len(compiled.commands),
+            "interpreted": interpreted,
+            "fallbacks": dict(fallbacks),
+        }
+        for identifier, (count, seconds) in compiled.timings.items():
+            entry = self.commands.setdefault(identifier, {"count": 0, "seconds": 0})
+            entry["count"] += count
+            entry["seconds"] += seconds
+        for reason in fallbacks.values():
+            self.fallbacks[reason] = self.fallbacks.get(reason, 0) + 1
+
+    def statuses(self) -> dict[str, int]:
+        out = {NATIVE: 0, PARTIAL: 0, INTERPRETED: 0}
+        for function in self.functions.values():
+            out[function["status"]] += 1
+        return out
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({
+                "summary": {
+                    "functions": self.statuses(),
+                    "fallbacks": sum(self.fallbacks.values()),
+                },
+                "commands": self.commands,
+                "fallbacks": dict(sorted(self.fallbacks.items(), key=lambda item: -item[1])),
+                "functions": self.functions,
+            }, f, indent=4)
+
+    def summary(self, top: int = 10) -> str:
+        statuses = self.statuses()
+        lines = [
+            f"compiled {len(self.functions)} functions: {statuses[NATIVE]} native, {statuses[PARTIAL]} partially native, {statuses[INTERPRETED]} interpreted",
+            f"{sum(self.fallbacks.values())} commands fall back to the dispatcher",
+        ]
+        for reason, count in sorted(self.fallbacks.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"    {count:>6}x {reason}")
+        lines.append("slowest commands to compile:")
+        for identifier, entry in sorted(self.commands.items(), key=lambda item: -item[1]["seconds"])[:top]:
+            lines.append(f"    {entry['seconds']:>8.4f}s {identifier} ({entry['count']}x)")
+        return "\n".join(lines)
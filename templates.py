@@ -1,113 +1,428 @@
-function_template = """
-    case "{function}":
-        {body}
-        return 0;
-"""
-
-entry_point_template = """
-package datapack.{name};
-
+imports = """
 import com.mojang.brigadier.CommandDispatcher;
+import com.mojang.brigadier.ParseResults;
+import com.mojang.brigadier.ResultConsumer;
+import com.mojang.brigadier.StringReader;
 import com.mojang.brigadier.arguments.StringArgumentType;
+import com.mojang.brigadier.context.ContextChain;
 import com.mojang.brigadier.exceptions.CommandSyntaxException;
-import com.mojang.datafixers.util.Pair;
+import com.mojang.brigadier.exceptions.DynamicCommandExceptionType;
+import com.mojang.brigadier.exceptions.SimpleCommandExceptionType;
 import net.fabricmc.api.ModInitializer;
 import net.fabricmc.fabric.api.command.v2.CommandRegistrationCallback;
+import net.fabricmc.fabric.api.event.lifecycle.v1.ServerLifecycleEvents;
 import net.minecraft.advancements.critereon.*;
 import net.minecraft.commands.*;
 import net.minecraft.commands.arguments.*;
 import net.minecraft.commands.arguments.selector.EntitySelector;
+import net.minecraft.commands.execution.ExecutionContext;
+import net.minecraft.commands.functions.CommandFunction;
+import net.minecraft.commands.functions.InstantiatedFunction;
 import net.minecraft.core.*;
 import net.minecraft.core.component.*;
 import net.minecraft.core.registries.*;
 import net.minecraft.nbt.*;
 import net.minecraft.network.chat.*;
 import net.minecraft.resources.*;
+import net.minecraft.server.MinecraftServer;
+import net.minecraft.server.bossevents.CustomBossEvent;
 import net.minecraft.server.RegistryLayer;
 import net.minecraft.server.commands.data.*;
+import net.minecraft.server.level.ServerLevel;
 import net.minecraft.server.level.ServerPlayer;
 import net.minecraft.server.players.PlayerList;
 import net.minecraft.tags.TagKey;
+import net.minecraft.util.Mth;
 import net.minecraft.world.entity.*;
+import net.minecraft.world.entity.player.Player;
+import net.minecraft.world.item.Item;
 import net.minecraft.world.item.ItemStack;
+import net.minecraft.world.level.biome.Biome;
+import net.minecraft.world.level.block.Block;
+import net.minecraft.world.level.block.Blocks;
+import net.minecraft.world.level.block.state.BlockState;
+import net.minecraft.world.level.chunk.LevelChunkSection;
+import net.minecraft.world.level.GameRules;
 import net.minecraft.world.level.GameType;
 import net.minecraft.world.level.levelgen.Heightmap;
 import net.minecraft.world.level.levelgen.structure.BoundingBox;
 import net.minecraft.world.phys.*;
+import net.minecraft.world.scores.*;
 import org.slf4j.*;
 
+import com.google.gson.*;
+import java.nio.file.*;
 import java.util.*;
 import java.util.function.*;
 import java.util.stream.Collectors;
+"""
+
+function_template = """
+    // {function}
+    static int {method}(CommandSourceStack source, CompoundTag marcos, CommandDispatcher<CommandSourceStack> dispatcher) throws CommandSyntaxException {{
+        {body}
+        return 0;
+    }}
+"""
+
+function_part_template = """
+    // {function}, part {part}
+    static MaybeReturn {method}(CommandSourceStack source, CompoundTag marcos, CommandDispatcher<CommandSourceStack> dispatcher) throws CommandSyntaxException {{
+        {body}
+        return new MaybeReturn(false, 0);
+    }}
+"""
+
+profile_template = """
+    /* a function id, or a function id and one of its commands on the next line, for every counter of instrumented builds, named by the shards */
+    static final String[] PROFILE_KEYS = new String[{count}];
+    static final long[] PROFILE_COUNTS = new long[PROFILE_KEYS.length];
+    static final long[] PROFILE_NANOS = new long[PROFILE_KEYS.length];
 
+    static void profile(int counter, long start) {{
+        PROFILE_COUNTS[counter]++;
+        PROFILE_NANOS[counter] += System.nanoTime() - start;
+    }}
+
+    /* read by the compiler through its `profile` option */
+    private static void writeProfile(MinecraftServer server) {{
+        var functions = new JsonObject();
+        for (int i = 0; i < PROFILE_KEYS.length; i++) {{
+            var entry = new JsonObject();
+            entry.addProperty("count", PROFILE_COUNTS[i]);
+            entry.addProperty("nanos", PROFILE_NANOS[i]);
+            var key = PROFILE_KEYS[i].split("\\n", 2);
+            if (key.length == 1) {{
+                entry.add("commands", new JsonObject());
+                functions.add(key[0], entry);
+            }} else {{
+                functions.getAsJsonObject(key[0]).getAsJsonObject("commands").add(key[1], entry);
+            }}
+        }}
+        var root = new JsonObject();
+        root.add("functions", functions);
+        root.addProperty("ticks", server.getTickCount());
+        try {{
+            Files.writeString(Path.of("{file}"), new GsonBuilder().setPrettyPrinting().create().toJson(root));
+        }} catch (Exception e) {{
+            LOGGER.error("could not write the profile", e);
+        }}
+    }}
+"""
+
+entry_point_template = """
+package datapack.{name};
+
+{imports}
 public class EntryPoint implements ModInitializer {{
-    public static List<String> COMPILED = List.of(
-        {to_compile}    
-    );
-    
+    interface Compiled {{
+        int run(CommandSourceStack source, CompoundTag marcos, CommandDispatcher<CommandSourceStack> dispatcher) throws CommandSyntaxException;
+    }}
+
+    /* indexed by the literal the datapack passes to _function__{name}, every shard fills in its own functions */
+    private static final Compiled[] FUNCTIONS = new Compiled[{count}];
+    private static final String[] IDS = new String[{count}];
+
+    public static List<String> COMPILED = Arrays.asList(IDS);
+
+    private static final Map<String, Compiled> BY_ID = new HashMap<>();
+    private static final Map<ResourceLocation, Compiled> BY_LOCATION = new HashMap<>();
+    static final CompoundTag NO_MACROS = new CompoundTag();
+
+    static void registerFunction(int index, String id, Compiled compiled) {{
+        FUNCTIONS[index] = compiled;
+        IDS[index] = id;
+        BY_ID.put(id, compiled);
+        BY_LOCATION.put(ResourceLocation.parse(id), compiled);
+    }}
+
+    /* loads every shard, which resolves their static fields, so this waits until the server starts and every mod registered its content */
+    private static void registerFunctions() {{
+        {register}
+    }}
+
+    /* function tags that couldn't be expanded at build time, resolved once per reload */
+    record TagMember(CommandFunction<CommandSourceStack> function, Compiled compiled) {{ }}
+    private static final Map<ResourceLocation, List<TagMember>> TAGS = new HashMap<>();
+
+    static List<TagMember> functionTag(MinecraftServer server, ResourceLocation id) {{
+        return TAGS.computeIfAbsent(id, key -> {{
+            List<TagMember> members = new ArrayList<>();
+            for (var func : server.getFunctions().getTag(key))
+                members.add(new TagMember(func, BY_LOCATION.get(func.id())));
+            return members;
+        }});
+    }}
+
+    private static final ResultConsumer<CommandSourceStack> NO_RESULT = (context, success, result) -> {{ }};
+
+    /* null for commands that don't parse, those keep going through the dispatcher so they fail the same way they always did */
+    private static ContextChain<CommandSourceStack> flatten(ParseResults<CommandSourceStack> parse, String command) {{
+        if (parse.getReader().canRead() || !parse.getExceptions().isEmpty())
+            return null;
+        return ContextChain.tryFlatten(parse.getContext().build(command)).orElse(null);
+    }}
+
+    /* a command the compiler left to the dispatcher, parsed once after the server starts and after every reload */
+    static final class Fallback {{
+        final String command;
+        ContextChain<CommandSourceStack> chain;
+
+        Fallback(String command) {{
+            this.command = command;
+            FALLBACKS.add(this);
+        }}
+
+        int execute(CommandSourceStack source, CommandDispatcher<CommandSourceStack> dispatcher) throws CommandSyntaxException {{
+            var chain = this.chain;
+            if (chain == null)
+                return dispatcher.execute(dispatcher.parse(command, source));
+            return chain.executeAll(source, NO_RESULT);
+        }}
+    }}
+    private static final List<Fallback> FALLBACKS = new ArrayList<>();
+
+    private static void parseFallbacks(MinecraftServer server) {{
+        var dispatcher = server.getCommands().getDispatcher();
+        /* the permission level functions are compiled with, so a fallback parses only if the function could run it */
+        var source = server.createCommandSourceStack().withPermission(server.getFunctionCompilationLevel());
+        for (Fallback fallback : FALLBACKS)
+            fallback.chain = flatten(dispatcher.parse(fallback.command, source), fallback.command);
+    }}
+
+    /* a $ line, the parsed command is kept for the most recently used arguments */
+    static final class MacroLine {{
+        final String[] text;
+
+        MacroLine(String... text) {{
+            this.text = text;
+        }}
+
+        int execute(CommandSourceStack source, CommandDispatcher<CommandSourceStack> dispatcher, String... values) throws CommandSyntaxException {{
+            var key = new MacroKey(this, List.of(values));
+            var chain = MACRO_CACHE.get(key);
+            if (chain != null) {{
+                MACRO_HITS++;
+                return chain.executeAll(source, NO_RESULT);
+            }}
+            MACRO_MISSES++;
+            var command = new StringBuilder(text[0]);
+            for (int i = 0; i < values.length; i++)
+                command.append(values[i]).append(text[i + 1]);
+            var parse = dispatcher.parse(command.toString(), source);
+            chain = flatten(parse, command.toString());
+            if (chain == null)
+                return dispatcher.execute(parse);
+            MACRO_CACHE.put(key, chain);
+            return chain.executeAll(source, NO_RESULT);
+        }}
+    }}
+    private record MacroKey(MacroLine line, List<String> values) {{ }}
+
+    private static final int MACRO_CACHE_SIZE = {macro_cache};
+    private static final Map<MacroKey, ContextChain<CommandSourceStack>> MACRO_CACHE = new LinkedHashMap<>(16, 0.75f, true) {{
+        @Override
+        protected boolean removeEldestEntry(Map.Entry<MacroKey, ContextChain<CommandSourceStack>> eldest) {{
+            return size() > MACRO_CACHE_SIZE;
+        }}
+    }};
+    private static long MACRO_HITS = 0;
+    private static long MACRO_MISSES = 0;
+
+    public static long macroCacheHits() {{
+        return MACRO_HITS;
+    }}
+
+    public static long macroCacheMisses() {{
+        return MACRO_MISSES;
+    }}
+    {profile}
     public static String MODID = "{name}";
     public static final Logger LOGGER = LoggerFactory.getLogger(MODID);
 
-	{depots}
-
     @Override
     public void onInitialize() {{
         LOGGER.info("Initilizing {name}");
+        ServerLifecycleEvents.SERVER_STARTING.register(server -> registerFunctions());
+        ServerLifecycleEvents.SERVER_STARTED.register(server -> {{
+            /* also initializes every shard, which registers their fallbacks before they are parsed */
+            {resolve_on_start}
+            parseFallbacks(server);
+        }});
+        ServerLifecycleEvents.END_DATA_PACK_RELOAD.register((server, resources, success) -> {{
+            TAGS.clear();
+            MACRO_CACHE.clear();
+            parseFallbacks(server);
+        }});
+        {on_stop}
         CommandRegistrationCallback.EVENT.register((dispatcher, registryAccess, environment) -> {{
-            dispatcher.register(Commands.literal("_function__{name}")
-                    .requires(ctx -> ctx.hasPermission(2))
-                    .then(Commands.argument("id", StringArgumentType.word()).then(Commands.argument("macros", CompoundTagArgument.compoundTag()).executes(
-                            ctx -> function(ctx.getSource(), StringArgumentType.getString(ctx, "id"), CompoundTagArgument.getCompoundTag(ctx, "macros"), dispatcher)
-                    ))));
+            var root = Commands.literal("_function__{name}").requires(ctx -> ctx.hasPermission(2));
+            /* commands are registered before the server starts, so the functions are only looked up once they run */
+            for (int i = 0; i < FUNCTIONS.length; i++) {{
+                final int index = i;
+                root.then(Commands.literal(Integer.toString(i))
+                        .executes(ctx -> FUNCTIONS[index].run(ctx.getSource(), NO_MACROS, dispatcher))
+                        .then(Commands.argument("macros", CompoundTagArgument.compoundTag()).executes(
+                                ctx -> FUNCTIONS[index].run(ctx.getSource(), CompoundTagArgument.getCompoundTag(ctx, "macros"), dispatcher)
+                        )));
+            }}
+            dispatcher.register(root);
         }});
     }}
     
-    private enum Sort implements BiConsumer<Vec3, List<? extends Entity>> {{
-        NEAREST("nearest", (pos, pair) -> pair.getFirst().position().distanceToSqr(pos) > pair.getSecond().position().distanceToSqr(pos)),
-        FURTHEST("furthest", (pos, pair) -> pair.getFirst().position().distanceToSqr(pos) < pair.getSecond().position().distanceToSqr(pos)),
-        ARBITRARY("arbitrary", (pos, pair) -> false),
-        RANDOM("random", null);
-        
-        final String id;
-        final BiPredicate<Vec3, Pair<Entity, Entity>> predicate;
-        
-        Sort(String id, BiPredicate<Vec3, Pair<Entity, Entity>> predicate) {{
-            this.id = id;
-            this.predicate = predicate;
+    /* a scoreboard objective or team, looked up at most once per tick instead of for every entity a selector tests */
+    static final class Named<T> {{
+        final String name;
+        final BiFunction<Scoreboard, String, T> lookup;
+        T value;
+        int tick = -1;
+
+        Named(String name, BiFunction<Scoreboard, String, T> lookup) {{
+            this.name = name;
+            this.lookup = lookup;
         }}
-    
+
+        T get(MinecraftServer server) {{
+            /* missing ones are looked up again as they could be added any time */
+            if (value == null || tick != server.getTickCount()) {{
+                value = lookup.apply(server.getScoreboard(), name);
+                tick = server.getTickCount();
+            }}
+            return value;
+        }}
+    }}
+
+    private static final DynamicCommandExceptionType OBJECTIVE_NOT_FOUND = new DynamicCommandExceptionType(name -> Component.translatable("arguments.objective.notFound", name));
+    private static final DynamicCommandExceptionType OBJECTIVE_READ_ONLY = new DynamicCommandExceptionType(name -> Component.translatable("arguments.objective.readonly", name));
+
+    private static final SimpleCommandExceptionType SCORE_HOLDERS_EMPTY = new SimpleCommandExceptionType(Component.translatable("argument.scoreHolder.empty"));
+
+    /* the score holders a selector or `*` found, there has to be at least one */
+    static <T extends ScoreHolder> Collection<T> scoreHolders(Collection<T> holders) throws CommandSyntaxException {{
+        if (holders.isEmpty())
+            throw SCORE_HOLDERS_EMPTY.create();
+        return holders;
+    }}
+
+    /* the objective of a scoreboard command, failing the way the objective argument does */
+    static Objective objective(Named<Objective> named, MinecraftServer server, boolean writable) throws CommandSyntaxException {{
+        Objective objective = named.get(server);
+        if (objective == null)
+            throw OBJECTIVE_NOT_FOUND.create(named.name);
+        if (writable && objective.getCriteria().isReadOnly())
+            throw OBJECTIVE_READ_ONLY.create(named.name);
+        return objective;
+    }}
+
+    /* only orders as much of the list as the selector's limit keeps, the rest is left in any order */
+    static final class Sort implements BiConsumer<Vec3, List<? extends Entity>> {{
+        /* up to this limit the closest entities are picked one by one instead of sorting everything */
+        private static final int SELECT = 8;
+        private static final Random RANDOM = new Random();
+
+        final double sign;
+        final int limit;
+
+        private Sort(double sign, int limit) {{
+            this.sign = sign;
+            this.limit = limit;
+        }}
+
+        static Sort nearest(int limit) {{
+            return new Sort(1, limit);
+        }}
+
+        static Sort furthest(int limit) {{
+            return new Sort(-1, limit);
+        }}
+
+        static Sort random(int limit) {{
+            return new Sort(0, limit);
+        }}
+
+        private record Keyed(double key, Entity entity) {{ }}
+
         @Override
-        public void accept(Vec3 vec3, List<? extends Entity> entities) {{
-            if (predicate == null) {{
-                Collections.shuffle(entities);
+        public void accept(Vec3 pos, List<? extends Entity> entities) {{
+            List<Entity> list = (List<Entity>) entities;
+            int n = list.size();
+            int k = Math.min(limit, n);
+            if (sign == 0) {{
+                sample(list, k);
                 return;
             }}
-            
-            List<Entity> modifiableEntities = new ArrayList<>(entities);
-            while (true) {{
-                boolean okay = true;
-                Entity last = null;
-                int i = 0;
-                for (Entity entity : modifiableEntities) {{
-                    if (last != null && predicate.test(vec3, Pair.of(last, entity))) {{
-                        modifiableEntities.set(i, last);
-                        modifiableEntities.set(i - 1, entity);
-                        if (okay) okay = false;
-                    }}
-                    last = entity;
-                    i++;
+            if (k > SELECT) {{
+                Keyed[] keyed = new Keyed[n];
+                for (int i = 0; i < n; i++)
+                    keyed[i] = new Keyed(sign * list.get(i).distanceToSqr(pos), list.get(i));
+                Arrays.sort(keyed, Comparator.comparingDouble(Keyed::key));
+                for (int i = 0; i < k; i++)
+                    list.set(i, keyed[i].entity());
+                return;
+            }}
+            double[] keys = new double[n];
+            for (int i = 0; i < n; i++)
+                keys[i] = sign * list.get(i).distanceToSqr(pos);
+            for (int i = 0; i < k; i++) {{
+                int best = i;
+                for (int j = i + 1; j < n; j++)
+                    if (keys[j] < keys[best]) best = j;
+                /* shift instead of swapping so ties keep their order like a stable sort would */
+                Entity entity = list.get(best);
+                double key = keys[best];
+                for (int j = best; j > i; j--) {{
+                    list.set(j, list.get(j - 1));
+                    keys[j] = keys[j - 1];
                 }}
-                if (okay) {{
-                    for (int j = 0; j < entities.size(); j++) {{
-                        ((List<Entity>) entities).set(j, modifiableEntities.get(j));
-                    }}
-                    return;
+                list.set(i, entity);
+                keys[i] = key;
+            }}
+        }}
+
+        /* reservoir sampling, afterwards the first k entities are a random selection in random order */
+        private static void sample(List<Entity> list, int k) {{
+            for (int i = k; i < list.size(); i++) {{
+                int j = RANDOM.nextInt(i + 1);
+                if (j < k) {{
+                    Entity entity = list.get(j);
+                    list.set(j, list.get(i));
+                    list.set(i, entity);
                 }}
             }}
+            Collections.shuffle(list.subList(0, k), RANDOM);
+        }}
+    }}
+
+    static final int DATA_ON_GROUND = 1;
+    static final int DATA_HEALTH = 2;
+    static final int DATA_TAGS = 4;
+    static final int DATA_SELECTED_ITEM = 8;
+    static final int DATA_INVENTORY = 16;
+
+    /* the given keys of what new EntityDataAccessor(entity).getData() returns, without serializing the rest of the entity */
+    static CompoundTag entityData(Entity entity, int keys) {{
+        CompoundTag data = new CompoundTag();
+        if ((keys & DATA_ON_GROUND) != 0)
+            data.putBoolean("OnGround", entity.onGround());
+        if ((keys & DATA_HEALTH) != 0 && entity instanceof LivingEntity living)
+            data.putFloat("Health", living.getHealth());
+        if ((keys & DATA_TAGS) != 0 && !entity.getTags().isEmpty()) {{
+            ListTag tags = new ListTag();
+            for (String tag : entity.getTags())
+                tags.add(StringTag.valueOf(tag));
+            data.put("Tags", tags);
+        }}
+        if (entity instanceof Player player) {{
+            ItemStack selected = player.getInventory().getSelected();
+            if ((keys & DATA_SELECTED_ITEM) != 0 && !selected.isEmpty())
+                data.put("SelectedItem", selected.save(player.registryAccess()));
+            if ((keys & DATA_INVENTORY) != 0)
+                data.put("Inventory", player.getInventory().save(new ListTag()));
         }}
+        return data;
     }}
 
-    private static boolean nbtMatches(CompoundTag original, CompoundTag with) {{
+    static boolean nbtMatches(CompoundTag original, CompoundTag with) {{
         for (key in original.getAllKeys()) {{
             if (!with.contains(key)) continue;
             TagType<? extends Tag> o = original.get(key).getType();
@@ -127,7 +442,7 @@ public class EntryPoint implements ModInitializer {{
         }}
         return true;
     }}
-    private static boolean nbtMatches(CollectionTag<?> original, CollectionTag<?> with) {{
+    static boolean nbtMatches(CollectionTag<?> original, CollectionTag<?> with) {{
         int i = 0;
         for (tag in with) {{
             if (!original.contains(tag)) return false; //TODO: confirm
@@ -136,7 +451,188 @@ public class EntryPoint implements ModInitializer {{
         return true;
     }}
 
-    private static Vec2 rotationFromDirection(Vec3 vec) {{
+    /* the section of a chunk holding the given section coordinates, null above or below the world */
+    private static LevelChunkSection section(ServerLevel level, int x, int y, int z) {{
+        int index = level.getSectionIndexFromSectionY(y);
+        if (index < 0 || index >= level.getSectionsCount())
+            return null;
+        return level.getChunk(x, z).getSection(index);
+    }}
+
+    /* whether the palette of a section holds nothing but plain air, cave and void air are compared like any block */
+    static boolean onlyAir(LevelChunkSection section) {{
+        return section != null && !section.getStates().maybeHas(state -> !state.is(Blocks.AIR));
+    }}
+
+    /*
+     * what execute if blocks tests, the amount of compared blocks or -1 as soon as one differs or a chunk isn't loaded.
+     * the source region is walked one chunk section at a time, so states come straight from the section instead of a chunk lookup per block,
+     * and so does the destination when both regions are aligned to sections
+     */
+    static int compareBlocks(ServerLevel level, Vec3i start, Vec3i end, Vec3i destination, boolean masked) {{
+        var original = BoundingBox.fromCorners(start, end);
+        int dx = destination.getX() - original.minX();
+        int dy = destination.getY() - original.minY();
+        int dz = destination.getZ() - original.minZ();
+        if (!level.hasChunksAt(original.minX(), original.minZ(), original.maxX(), original.maxZ())
+                || !level.hasChunksAt(original.minX() + dx, original.minZ() + dz, original.maxX() + dx, original.maxZ() + dz))
+            return -1;
+        boolean aligned = ((dx | dy | dz) & 15) == 0;
+        var originalPos = new BlockPos.MutableBlockPos();
+        var comparePos = new BlockPos.MutableBlockPos();
+        int count = 0;
+        for (int sx = original.minX() >> 4; sx <= original.maxX() >> 4; sx++)
+            for (int sz = original.minZ() >> 4; sz <= original.maxZ() >> 4; sz++)
+                for (int sy = original.minY() >> 4; sy <= original.maxY() >> 4; sy++) {{
+                    var section = section(level, sx, sy, sz);
+                    var target = aligned ? section(level, sx + (dx >> 4), sy + (dy >> 4), sz + (dz >> 4)) : null;
+                    int minX = Math.max(original.minX(), sx << 4), maxX = Math.min(original.maxX(), (sx << 4) + 15);
+                    int minY = Math.max(original.minY(), sy << 4), maxY = Math.min(original.maxY(), (sy << 4) + 15);
+                    int minZ = Math.max(original.minZ(), sz << 4), maxZ = Math.min(original.maxZ(), (sz << 4) + 15);
+                    if (onlyAir(section)) {{
+                        if (masked)
+                            continue;
+                        if (onlyAir(target)) {{
+                            count += (maxX - minX + 1) * (maxY - minY + 1) * (maxZ - minZ + 1);
+                            continue;
+                        }}
+                    }}
+                    for (int x = minX; x <= maxX; x++)
+                        for (int y = minY; y <= maxY; y++)
+                            for (int z = minZ; z <= maxZ; z++) {{
+                                originalPos.set(x, y, z);
+                                comparePos.set(x + dx, y + dy, z + dz);
+                                BlockState state = section != null ? section.getBlockState(x & 15, y & 15, z & 15) : level.getBlockState(originalPos);
+                                if (masked && state.is(Blocks.AIR))
+                                    continue;
+                                BlockState compare = target != null ? target.getBlockState(x & 15, y & 15, z & 15) : level.getBlockState(comparePos);
+                                if (state != compare)
+                                    return -1;
+                                if (state.hasBlockEntity()) {{
+                                    var originalEntity = level.getBlockEntity(originalPos);
+                                    var compareEntity = level.getBlockEntity(comparePos);
+                                    if (originalEntity != null && (compareEntity == null || !originalEntity.components().equals(compareEntity.components())))
+                                        return -1;
+                                }}
+                                count++;
+                            }}
+                }}
+        return count;
+    }}
+
+    private static final SimpleCommandExceptionType DATA_UNCHANGED = new SimpleCommandExceptionType(Component.translatable("commands.data.merge.failed"));
+    private static final SimpleCommandExceptionType DATA_MULTIPLE = new SimpleCommandExceptionType(Component.translatable("commands.data.get.multiple"));
+    private static final SimpleCommandExceptionType DATA_NOT_A_BLOCK_ENTITY = new SimpleCommandExceptionType(Component.translatable("commands.data.block.invalid"));
+    private static final DynamicCommandExceptionType DATA_INVALID = new DynamicCommandExceptionType(path -> Component.translatable("commands.data.get.invalid", path));
+    private static final DynamicCommandExceptionType DATA_UNKNOWN = new DynamicCommandExceptionType(path -> Component.translatable("commands.data.get.unknown", path));
+    private static final DynamicCommandExceptionType DATA_EXPECTED_OBJECT = new DynamicCommandExceptionType(tag -> Component.translatable("commands.data.modify.expected_object", tag));
+
+    /* the block entity at pos as the target or source of a data command */
+    static DataAccessor blockData(CommandSourceStack source, BlockPos pos) throws CommandSyntaxException {{
+        var entity = source.getLevel().getBlockEntity(pos);
+        if (entity == null)
+            throw DATA_NOT_A_BLOCK_ENTITY.create();
+        return new BlockDataAccessor(entity, pos);
+    }}
+
+    private static Tag singleTag(CompoundTag data, NbtPathArgument.NbtPath path) throws CommandSyntaxException {{
+        var tags = path.get(data);
+        if (tags.size() > 1)
+            throw DATA_MULTIPLE.create();
+        return tags.get(0);
+    }}
+
+    /* what data get returns for the tag path points to */
+    static int dataGet(CompoundTag data, NbtPathArgument.NbtPath path) throws CommandSyntaxException {{
+        Tag tag = singleTag(data, path);
+        if (tag instanceof NumericTag numeric)
+            return Mth.floor(numeric.getAsDouble());
+        if (tag instanceof CollectionTag<?> collection)
+            return collection.size();
+        if (tag instanceof CompoundTag compound)
+            return compound.size();
+        if (tag instanceof StringTag string)
+            return string.getAsString().length();
+        throw DATA_UNKNOWN.create(path.toString());
+    }}
+
+    static int dataGet(CompoundTag data, NbtPathArgument.NbtPath path, double scale) throws CommandSyntaxException {{
+        if (singleTag(data, path) instanceof NumericTag numeric)
+            return Mth.floor(numeric.getAsDouble() * scale);
+        throw DATA_INVALID.create(path.toString());
+    }}
+
+    /* data modify ... merge, the amount of compounds on the path that changed */
+    static int dataMerge(CompoundTag data, NbtPathArgument.NbtPath path, List<Tag> sources) throws CommandSyntaxException {{
+        /* the sources are checked before the path creates anything in the target */
+        var merged = new CompoundTag();
+        for (Tag source : sources) {{
+            if (NbtPathArgument.NbtPath.isTooDeep(source, 0))
+                throw NbtPathArgument.ERROR_DATA_TOO_DEEP.create();
+            if (!(source instanceof CompoundTag compound))
+                throw DATA_EXPECTED_OBJECT.create(source);
+            merged.merge(compound);
+        }}
+        int changed = 0;
+        for (Tag target : path.getOrCreate(data, CompoundTag::new)) {{
+            if (!(target instanceof CompoundTag compound))
+                throw DATA_EXPECTED_OBJECT.create(target);
+            var before = compound.copy();
+            compound.merge(merged);
+            if (!before.equals(compound))
+                changed++;
+        }}
+        return changed;
+    }}
+
+    /* the tag types execute store can write, from the scaled value */
+    static final DoubleFunction<Tag> STORE_BYTE = value -> ByteTag.valueOf((byte) value);
+    static final DoubleFunction<Tag> STORE_SHORT = value -> ShortTag.valueOf((short) value);
+    static final DoubleFunction<Tag> STORE_INT = value -> IntTag.valueOf((int) value);
+    static final DoubleFunction<Tag> STORE_LONG = value -> LongTag.valueOf((long) value);
+    static final DoubleFunction<Tag> STORE_FLOAT = value -> FloatTag.valueOf((float) value);
+    static final DoubleFunction<Tag> STORE_DOUBLE = value -> DoubleTag.valueOf(value);
+
+    private static final DynamicCommandExceptionType BOSSBAR_NOT_FOUND = new DynamicCommandExceptionType(id -> Component.translatable("commands.bossbar.unknown", id));
+
+    /* execute store ... score, the targets are resolved once the store subcommand runs like the dispatcher does */
+    static CommandResultCallback storeScore(Scoreboard scoreboard, Collection<? extends ScoreHolder> holders, Objective objective, boolean result) {{
+        return (success, value) -> {{
+            int stored = result ? value : (success ? 1 : 0);
+            for (ScoreHolder holder : holders)
+                scoreboard.getOrCreatePlayerScore(holder, objective).set(stored);
+        }};
+    }}
+
+    /* execute store ... block|entity|storage */
+    static CommandResultCallback storeData(DataAccessor accessor, NbtPathArgument.NbtPath path, DoubleFunction<Tag> type, double scale, boolean result) {{
+        return (success, value) -> {{
+            int stored = result ? value : (success ? 1 : 0);
+            try {{
+                CompoundTag data = accessor.getData();
+                path.set(data, type.apply(stored * scale));
+                accessor.setData(data);
+            }} catch (CommandSyntaxException e) {{
+                /* the dispatcher ignores these as well */
+            }}
+        }};
+    }}
+
+    /* execute store ... bossbar */
+    static CommandResultCallback storeBossbar(CommandSourceStack source, ResourceLocation id, boolean max, boolean result) throws CommandSyntaxException {{
+        CustomBossEvent bossbar = source.getServer().getCustomBossEvents().get(id);
+        if (bossbar == null)
+            throw BOSSBAR_NOT_FOUND.create(id.toString());
+        return (success, value) -> {{
+            int stored = result ? value : (success ? 1 : 0);
+            if (max)
+                bossbar.setMax(stored);
+            else
+                bossbar.setValue(stored);
+        }};
+    }}
+
+    static Vec2 rotationFromDirection(Vec3 vec) {{
         float pitch = (float) Math.asin(vec.y);
         float h = (float) Math.sqrt(vec.x * vec.x + vec.z * vec.z);
 
@@ -145,17 +641,17 @@ public class EntryPoint implements ModInitializer {{
         return new Vec2(pitch * (180F / (float) Math.PI), yaw * (180F / (float) Math.PI));
     }}
 
-    private static Vec3i toVec3i(Vec3 vec3) {{
+    static Vec3i toVec3i(Vec3 vec3) {{
         return new Vec3i((int) vec3.x(), (int) vec3.y(), (int) vec3.z());
     }}
 
-    private static CompoundTag returnIfMatches(Tag value, CompoundTag with) {{
+    static CompoundTag returnIfMatches(Tag value, CompoundTag with) {{
         if (value instanceof CompoundTag)
             return nbtMatches(value, with) ? value : new CompoundTag();
         return new CompoundTag();
     }}
 
-    private record MaybeReturn(boolean maybe, int value) {{
+    record MaybeReturn(boolean maybe, int value) {{
         Object out() {{
             if (maybe)
                 return (Integer) value;
@@ -165,14 +661,53 @@ public class EntryPoint implements ModInitializer {{
     
     class Termination extends Exception {{ }}
     
-    private static int function(CommandSourceStack source, String id, CompoundTag marcos, CommandDispatcher<CommandSourceStack> dispatcher) throws CommandSyntaxException {{
-		switch (id) {{
-			{commands}
-			default:
-				source.sendFailure(Component.literal("unable to find: " + id));
-                return -1;
-		}}
+    static int function(CommandSourceStack source, String id, CompoundTag marcos, CommandDispatcher<CommandSourceStack> dispatcher) throws CommandSyntaxException {{
+        var compiled = BY_ID.get(id);
+        if (compiled == null) {{
+            source.sendFailure(Component.literal("unable to find: " + id));
+            return -1;
+        }}
+        return compiled.run(source, marcos, dispatcher);
 	}}
+
+    /* runs a function that was not compiled to its end, `callback` only hears of it when the function returns */
+    static void runFunction(CommandSourceStack source, CommandFunction<CommandSourceStack> function, CompoundTag marcos, CommandDispatcher<CommandSourceStack> dispatcher, CommandResultCallback callback) throws CommandSyntaxException {{
+        InstantiatedFunction<CommandSourceStack> instantiated;
+        try {{
+            instantiated = function.instantiate(marcos, dispatcher);
+        }} catch (FunctionInstantiationException e) {{
+            throw new SimpleCommandExceptionType(e.messageComponent()).create();
+        }}
+        var server = source.getServer();
+        var rules = server.getGameRules();
+        try (var context = new ExecutionContext<CommandSourceStack>(Math.max(1, rules.getInt(GameRules.RULE_MAX_COMMAND_CHAIN_LENGTH)), rules.getInt(GameRules.RULE_MAX_COMMAND_FORK_COUNT), server.getProfiler())) {{
+            ExecutionContext.queueInitialFunctionCall(context, instantiated, source, callback);
+            context.runCommandQueue();
+        }}
+    }}
+}}
+"""
+
+shard_template = """
+package datapack.{name};
+
+{imports}
+import datapack.{name}.EntryPoint.*;
+import static datapack.{name}.EntryPoint.*;
+{shard_imports}
+
+/*
+ * part of the compiled datapack, the parts are kept small so every method stays within what the JIT compiles.
+ * its static initializer only reads fields of earlier parts, its methods may call into any part
+ */
+class {shard} {{
+	{depots}
+
+    {functions}
+
+    static void registerFunctions() {{
+        {register}
+    }}
 }}
 """
 